@@ -0,0 +1,278 @@
+############ IMPORTS AND SETTINGS ############
+
+from pathlib import Path
+from time import perf_counter
+import argparse
+import hashlib
+import json
+import math
+import random
+import sys
+import numpy as np
+import glm
+from PIL import Image
+import moderngl
+import moderngl_window as mglw
+from moderngl_window.meta import ProgramDescription, TextureDescription
+from moderngl_window.scene import Camera
+from main import (CHUNK_SIZE, CHUNK_SECTIONS, PADDED_SIZE, MAX_CHUNK_QUADS, WORLD_W, WORLD_H, WORLD_D, PACKED_VERTICES,
+                  INDIRECT_DRAW_VERSION, World, generate_terrain, build_padded_voxels, build_padded_light,
+                  construct_chunk_mesh, construct_chunk_mesh_greedy, cast_ray, cast_rays)
+
+BENCH_SEED = 1
+BENCH_SIZE = (640, 480)
+BENCH_FRAMES = 120
+BENCH_TERRAIN_COLUMNS = 50
+BENCH_MESH_CHUNKS = 100
+BENCH_RAYS = 10000
+BENCH_RAY_BATCHES = 5
+BENCH_EDITS = 500
+BENCH_CARVES = 4
+# A timing counts as a regression when its p50 is this much slower than the baseline's; every timing is
+# recorded through summary(), even those taken once, so that compare() sees them all
+BENCH_TOLERANCE = 0.2
+# Fixed views (position, yaw, pitch) rendered with and without frustum culling, which must match pixel for pixel
+CULLING_VIEWS = (((160, 90, 160), 30, -25), ((50, 70, 50), 45, -30), ((160, 40, 160), 90, 0),
+                 ((160, 40, 160), 0, 85), ((300, 120, 20), 135, -45), ((-40, 60, 160), 0, -10))
+
+############ OFFSCREEN APP ############
+
+class OffscreenApp:
+    # Stands in for VoxelEngine: a standalone context rendering into a framebuffer, which needs no display
+    # and runs on software rasterisers such as llvmpipe; resources load the same way the engine loads them
+    def __init__(self, size=BENCH_SIZE, backend=None):
+        settings = {"backend": backend} if backend else {}
+        self.ctx = moderngl.create_standalone_context(require=330, **settings)
+        mglw.activate_context(ctx=self.ctx)
+        mglw.resources.register_dir((Path(__file__).parent / "resources").resolve())
+        shader = "chunk_packed.glsl" if PACKED_VERTICES else "chunk_texture_mapped.glsl"
+        defines = {"INDIRECT_DRAWS": int(self.ctx.version_code >= INDIRECT_DRAW_VERSION)}
+        self.program = mglw.resources.programs.load(ProgramDescription(path=shader, defines=defines))
+        self.texture_array = mglw.resources.textures.load(TextureDescription(path="tex_array_0.png", kind="array", layers=7, flip=True))
+        self.texture_array.use(location=0)
+        self.fbo = self.ctx.framebuffer(color_attachments=[self.ctx.renderbuffer(size)],
+                                        depth_attachment=self.ctx.depth_renderbuffer(size))
+        self.fbo.use()
+        self.ctx.front_face = "ccw"
+        self.camera = Camera(aspect_ratio=size[0] / size[1])
+        self.interaction_mode = 1
+        self.voxel_id_selection = 1
+
+    def render(self, world):
+        # Frame time covers mesh uploads, culling and drawing, waiting for the GPU to finish
+        start = perf_counter()
+        self.ctx.enable_only(moderngl.DEPTH_TEST | moderngl.CULL_FACE)
+        self.fbo.clear(0.0, 0.0, 0.0, depth=1.0)
+        self.program["m_proj"].write(self.camera.projection.matrix)
+        self.program["m_camera"].write(self.camera.matrix)
+        world.upload_meshes()
+        world.render()
+        self.ctx.finish()
+        return perf_counter() - start
+
+############ BENCHMARKS ############
+
+def summary(seconds):
+    # Milliseconds at each percentile of a list of timings
+    ms = np.array(seconds) * 1000
+    p50, p95, p99 = np.percentile(ms, (50, 95, 99))
+    return {"p50": p50, "p95": p95, "p99": p99, "max": ms.max(), "count": len(ms)}
+
+def bench_terrain(column_count):
+    # Terrain generation on its own: the fixed world in one call, then single columns as streaming generates them
+    start = perf_counter()
+    generate_terrain(0, 0, WORLD_W, WORLD_D)
+    world = perf_counter() - start
+    times = []
+    for i in range(column_count):
+        start = perf_counter()
+        generate_terrain(WORLD_W + i, -i, 1, 1)
+        times.append(perf_counter() - start)
+    return {"world_ms": summary([world]), "column_ms": summary(times)}
+
+def bench_meshing(world, chunk_count):
+    # Both meshers on the first non-empty chunks, from padded voxels and light built beforehand
+    padded = np.empty((PADDED_SIZE,) * 3, dtype=np.uint8)
+    padded_light = np.empty((PADDED_SIZE,) * 3, dtype=np.uint8)
+    quads = np.empty((MAX_CHUNK_QUADS, 8), dtype=np.uint8)
+    chunks = [chunk for chunk in world.chunks if world.solid_counts[chunk.index]][:chunk_count]
+    results = {}
+    for name, mesher in (("simple", construct_chunk_mesh), ("greedy", construct_chunk_mesh_greedy)):
+        times = []
+        for chunk in chunks:
+            build_padded_voxels(chunk.position, world.voxels, world.chunk_grid, padded)
+            build_padded_light(chunk.position, world.light, world.chunk_grid, 1, padded_light)
+            start = perf_counter()
+            mesher(padded, padded_light, quads)
+            times.append(perf_counter() - start)
+        results[name] = summary(times)
+    # The whole pipeline a remesh runs: every section at every LOD, written into vertex data
+    times = []
+    for chunk in chunks:
+        start = perf_counter()
+        chunk.mesh.mesh_sections(range(CHUNK_SECTIONS))
+        times.append(perf_counter() - start)
+    results["chunk"] = summary(times)
+    return results
+
+def random_rays(rng, count):
+    # Rays from above the terrain pointing down at random angles
+    size = np.array((WORLD_W, WORLD_H, WORLD_D)) * CHUNK_SIZE
+    origins = rng.uniform((0, 64, 0), (size[0], size[1], size[2]), size=(count, 3))
+    directions = rng.normal(size=(count, 3))
+    directions[:, 1] = -np.abs(directions[:, 1])
+    return origins, directions / np.linalg.norm(directions, axis=1, keepdims=True)
+
+def bench_raycasts(world, rng, count):
+    origins, directions = random_rays(rng, count)
+    times = []
+    for origin, direction in zip(origins[:count // 10], directions[:count // 10]):
+        start = perf_counter()
+        cast_ray(origin, direction, world.voxels, world.chunk_grid, world.solid_counts, world.brick_counts)
+        times.append(perf_counter() - start)
+    # The batch is timed as a whole, so it is compiled on one ray first
+    cast_rays(origins[:1], directions[:1], world.voxels, world.chunk_grid, world.solid_counts, world.brick_counts)
+    batches = []
+    for _ in range(BENCH_RAY_BATCHES):
+        start = perf_counter()
+        hits, _, _, _ = cast_rays(origins, directions, world.voxels, world.chunk_grid, world.solid_counts, world.brick_counts)
+        batches.append(perf_counter() - start)
+    return {"single_ms": summary(times), "batch_ms": summary(batches),
+            "batch_us_per_ray": np.median(batches) / count * 1e6, "hit_fraction": hits.mean()}
+
+def bench_edits(app, world, rng, edit_count, carve_count):
+    # Places or removes a voxel at the surface below random points, as a player would, then carves caves
+    size = (WORLD_W * CHUNK_SIZE, WORLD_H * CHUNK_SIZE, WORLD_D * CHUNK_SIZE)
+    times = []
+    for i in range(edit_count):
+        origin = (rng.randrange(size[0]) + 0.5, size[1] - 0.5, rng.randrange(size[2]) + 0.5)
+        hit, normal = cast_ray(origin, (0.0, -1.0, 0.0), world.voxels, world.chunk_grid, world.solid_counts, world.brick_counts)
+        if hit is None:
+            continue
+        start = perf_counter()
+        if i % 2:
+            world.remove_voxel(hit)
+        else:
+            app.voxel_id_selection = rng.randint(1, 7)
+            world.add_voxel(hit + normal)
+        times.append(perf_counter() - start)
+    carves = []
+    for _ in range(carve_count):
+        centre = (rng.randrange(size[0]), rng.randrange(16, 48), rng.randrange(size[2]))
+        start = perf_counter()
+        world.fill_sphere(centre, 12, 0)
+        carves.append(perf_counter() - start)
+    start = perf_counter()
+    world.finish_meshes()
+    remesh = perf_counter() - start
+    return {"edit_ms": summary(times), "carve_ms": summary(carves), "remesh_ms": summary([remesh])}
+
+def bench_camera_path(app, world, frame_count, image_dir=None, label=""):
+    # Orbits the world centre looking inwards; every frame is hashed, so any change in what is drawn shows up
+    centre = glm.vec3(WORLD_W, 0, WORLD_D) * CHUNK_SIZE / 2
+    checksum = hashlib.sha256()
+    times = []
+    for frame in range(frame_count):
+        angle = 2 * math.pi * frame / frame_count
+        app.camera.set_position(centre.x + 100 * math.cos(angle), 90, centre.z + 100 * math.sin(angle))
+        app.camera.set_rotation(math.degrees(angle) + 180, -25)
+        times.append(app.render(world))
+        pixels = app.fbo.read(components=3)
+        checksum.update(pixels)
+        if image_dir and frame % 30 == 0:
+            image_dir.mkdir(parents=True, exist_ok=True)
+            size = app.fbo.size
+            image = np.frombuffer(pixels, dtype=np.uint8).reshape(size[1], size[0], 3)[::-1]
+            Image.fromarray(image).save(image_dir / f"{label}_{frame:04d}.png")
+    return {"frame_ms": summary(times), "checksum": checksum.hexdigest()}
+
+def bench_culling(app, world):
+    # Culling may only drop sections that would not have been drawn anyway, so each view must render the same
+    views = []
+    for position, yaw, pitch in CULLING_VIEWS:
+        app.camera.set_position(*position)
+        app.camera.set_rotation(yaw, pitch)
+        images = []
+        for culling in (False, True):
+            world.frustum_culling = culling
+            app.render(world)
+            images.append(np.frombuffer(app.fbo.read(components=3), dtype=np.uint8).reshape(-1, 3))
+        views.append({"drawn": world.sections_drawn, "culled": world.sections_culled,
+                      "pixels_differing": int(np.any(images[0] != images[1], axis=1).sum())})
+    return views
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    script_rng = random.Random(args.seed)
+    app = OffscreenApp(backend=args.backend)
+    results = {"seed": args.seed, "renderer": app.ctx.info["GL_RENDERER"]}
+
+    # Includes the numba compilation of every kernel the first time round, lighting and meshing, so terrain
+    # generation is timed on its own as well
+    start = perf_counter()
+    world = World(app)
+    world.finish_meshes()
+    results["world_ms"] = summary([perf_counter() - start])
+
+    results["terrain"] = bench_terrain(args.terrain_columns)
+    results["meshing"] = bench_meshing(world, args.mesh_chunks)
+    results["raycast"] = bench_raycasts(world, rng, args.rays)
+    results["culling"] = bench_culling(app, world)
+    results["render"] = bench_camera_path(app, world, args.frames, args.images, "generated")
+    results["edits"] = bench_edits(app, world, script_rng, args.edits, args.carves)
+    results["render_edited"] = bench_camera_path(app, world, args.frames, args.images, "edited")
+    world.pool.shutdown()
+    return results
+
+def check(results):
+    # Problems that need no baseline to spot
+    return [f"culling: view {i} differs from the unculled render in {view['pixels_differing']} pixels"
+            for i, view in enumerate(results["culling"]) if view["pixels_differing"]]
+
+def compare(results, baseline, tolerance):
+    # Lists every changed checksum and every p50 slower than the baseline by more than tolerance
+    problems = []
+    for name in ("render", "render_edited"):
+        if results[name]["checksum"] != baseline[name]["checksum"]:
+            problems.append(f"{name}: image checksum changed")
+    def walk(new, old, path):
+        for key, value in new.items():
+            if isinstance(value, dict) and isinstance(old.get(key), dict):
+                if "p50" in value and "p50" in old[key]:
+                    if value["p50"] > old[key]["p50"] * (1 + tolerance):
+                        problems.append(f"{path}{key}: p50 {value['p50']:.3f} ms, was {old[key]['p50']:.3f} ms")
+                else:
+                    walk(value, old[key], f"{path}{key}.")
+    walk(results, baseline, "")
+    return problems
+
+############ ENTRY POINT ############
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless benchmark of world generation, meshing, raycasts, edits and rendering")
+    parser.add_argument("--seed", type=int, default=BENCH_SEED)
+    parser.add_argument("--frames", type=int, default=BENCH_FRAMES)
+    parser.add_argument("--terrain-columns", type=int, default=BENCH_TERRAIN_COLUMNS)
+    parser.add_argument("--mesh-chunks", type=int, default=BENCH_MESH_CHUNKS)
+    parser.add_argument("--rays", type=int, default=BENCH_RAYS)
+    parser.add_argument("--edits", type=int, default=BENCH_EDITS)
+    parser.add_argument("--carves", type=int, default=BENCH_CARVES)
+    parser.add_argument("--backend", default="egl" if sys.platform.startswith("linux") else None,
+                        help="context backend, egl on Linux so no display is needed")
+    parser.add_argument("--images", type=Path, help="directory to save every 30th frame of the camera path to")
+    parser.add_argument("--output", type=Path, help="file to write the results to as JSON")
+    parser.add_argument("--baseline", type=Path, help="earlier results to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=BENCH_TOLERANCE)
+    args = parser.parse_args()
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        args.output.write_text(text)
+    problems = check(results)
+    if args.baseline:
+        problems += compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    sys.exit(1 if problems else 0)
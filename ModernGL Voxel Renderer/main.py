@@ -1,6 +1,14 @@
 ############ IMPORTS AND SETTINGS ############
 
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import perf_counter
+import bisect
+import json
+import os
+import threading
 import numpy as np
 import glm
 from PIL import Image
@@ -8,11 +16,24 @@ import moderngl
 import moderngl_window as mglw
 from moderngl_window.scene import KeyboardCamera
 from moderngl_window.scene import Camera
-from numba import njit, uint8
+# Kernels are compiled with cache=True, which keeps their machine code in __pycache__ across launches
+from numba import njit
+# The profiler overlay is drawn with imgui when it is installed
+try:
+    import imgui
+    from moderngl_window.integrations.imgui import ModernglWindowRenderer
+except ImportError:
+    imgui = None
 
 CHUNK_SIZE = 32
 CHUNK_AREA = CHUNK_SIZE * CHUNK_SIZE
 CHUNK_VOL = CHUNK_AREA * CHUNK_SIZE
+PADDED_SIZE = CHUNK_SIZE + 2
+BRICK_SIZE = 4
+BRICK_AXIS = CHUNK_SIZE // BRICK_SIZE
+CHUNK_BRICKS = BRICK_AXIS ** 3
+SECTION_HEIGHT = 8
+CHUNK_SECTIONS = CHUNK_SIZE // SECTION_HEIGHT
 
 WORLD_W, WORLD_H = 10, 5
 WORLD_D = WORLD_W
@@ -22,7 +43,39 @@ WORLD_CENTRE_X = (WORLD_W * CHUNK_SIZE)//2
 WORLD_CENTER_Y = (WORLD_H * CHUNK_SIZE)//2
 WORLD_CENTER_Z = (WORLD_D * CHUNK_SIZE)//2
 
-MAX_RAY_DIST = 100
+MAX_RAY_DIST = 256
+
+# Sunlight and block light run from 0 to MAX_LIGHT, packed into a byte per voxel as sun << 4 | block
+MAX_LIGHT = 15
+# Block light given off by each voxel id
+LIGHT_EMISSION = np.zeros(256, dtype=np.uint8)
+LIGHT_EMISSION[2] = 14
+
+GREEDY_MESHING = True
+PACKED_VERTICES = True
+MESH_WORKERS = os.cpu_count() or 1
+MESH_UPLOAD_BUDGET_MS = 2.0
+ARENA_CAPACITY = 1 << 20
+# Indirect draws with a base instance need OpenGL 4.3; older contexts, such as macOS's 4.1, draw section by section
+INDIRECT_DRAW_VERSION = 430
+# Chunks are meshed at each scale and drawn at the coarsest one whose distance from the camera they are past
+LOD_SCALES = (1, 2, 4)
+LOD_DISTANCES = (96, 192)
+
+STREAMING_WORLD = False
+STREAM_RADIUS = 5
+STREAM_UPLOADS_PER_FRAME = 4
+
+SAVE_DIR = Path(__file__).parent / "saves"
+REGION_SIZE = 8
+REGION_CHUNKS = REGION_SIZE * WORLD_H * REGION_SIZE
+REGION_TABLE_BYTES = REGION_CHUNKS * 4 * 8
+
+# Frames of scope timings kept for the profiler's percentiles, and scope events kept for its trace
+PROFILE_FRAMES = 600
+PROFILE_EVENTS = 1 << 16
+# GPU timer results are read this many frames after they were issued, by when they are ready
+PROFILE_GPU_LATENCY = 3
 
 glm.silence(2)
 
@@ -44,228 +97,1421 @@ class CameraWindow(mglw.WindowConfig):
     def resize(self, width: int, height: int):
         self.camera.projection.update(aspect_ratio=self.wnd.aspect_ratio)
 
-############ MESHING ############
+############ TERRAIN ############
 
-@njit
-def vertex_to_uint8(x, y, z, voxel_id, face_id, u, v):
-    return uint8(x), uint8(y), uint8(z), uint8(voxel_id), uint8(face_id), uint8(u), uint8(v)
+def simplex_noise(x, y):
+    # Vectorised float32 port of glm.simplex(vec2), matching it bit for bit
+    f = np.float32
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=f), np.asarray(y, dtype=f))
+    c_x, c_y, c_z, c_w = f(0.211324865405187), f(0.366025403784439), f(-0.577350269189626), f(0.024390243902439)
 
-@njit
-def add_face(vertex_data, index, v0, v1, v2, v3):
-    for vertex in (v0, v1, v2, v2, v3, v0):
-        for attr in vertex:
-            vertex_data[index] = attr
-            index += 1
-    return index
+    # First corner
+    skew = x * c_y + y * c_y
+    ix = np.floor(x + skew)
+    iy = np.floor(y + skew)
+    unskew = ix * c_x + iy * c_x
+    x0 = (x - ix) + unskew
+    y0 = (y - iy) + unskew
+
+    # Other corners
+    i1x = (x0 > y0).astype(f)
+    i1y = f(1) - i1x
+    corners = ((x0, y0), (x0 + c_x - i1x, y0 + c_x - i1y), (x0 + c_z, y0 + c_z))
+
+    # Permutations
+    ix = ix - f(289) * np.floor(ix / f(289))
+    iy = iy - f(289) * np.floor(iy / f(289))
+    inv_289 = f(1) / f(289)
+    def permute(v):
+        v = ((v * f(34)) + f(1)) * v
+        return v - np.floor(v * inv_289) * f(289)
+
+    noise = np.zeros_like(x)
+    for (ox, oy), (cx, cy) in zip(((0, 0), (i1x, i1y), (1, 1)), corners):
+        p = permute(permute(iy + f(oy)) + ix + f(ox))
+        m = np.maximum(f(0.5) - (cx * cx + cy * cy), f(0))
+        m = m * m
+        m = m * m
+
+        # Gradients: 41 points uniformly over a line, mapped onto a diamond
+        gx = p * c_w
+        gx = f(2) * (gx - np.floor(gx)) - f(1)
+        h = np.abs(gx) - f(0.5)
+        a0 = gx - np.floor(gx + f(0.5))
+        m = m * (f(1.79284291400159) - f(0.85373472095314) * (a0 * a0 + h * h))
+        noise = noise + m * (a0 * cx + h * cy)
+    return f(130) * noise
+
+def generate_terrain(cx, cz, width, depth):
+    # Voxels for a width x WORLD_H x depth block of chunks, shaped (depth, WORLD_H, width, CHUNK_VOL)
+    wx = np.arange(cx * CHUNK_SIZE, (cx + width) * CHUNK_SIZE, dtype=np.float32)
+    wz = np.arange(cz * CHUNK_SIZE, (cz + depth) * CHUNK_SIZE, dtype=np.float32)
+    noise = simplex_noise(wx[None, :] * np.float32(0.01), wz[:, None] * np.float32(0.01))
+    heights = (noise.astype(np.float64) * 32 + 32).astype(np.int64)
+
+    wy = np.arange(WORLD_H * CHUNK_SIZE)
+    voxels = np.where(wy[None, :, None] < heights[:, None, :], np.uint8(6), np.uint8(0))
+    voxels = voxels.reshape(depth, CHUNK_SIZE, WORLD_H, CHUNK_SIZE, width, CHUNK_SIZE)
+    return voxels.transpose(0, 2, 4, 1, 3, 5).reshape(depth, WORLD_H, width, CHUNK_VOL)
+
+############ VOXEL STORAGE ############
+
+class PaletteChunk:
+    # A chunk's voxels as indices into a palette of the ids it holds, bit-packed at 1, 2, 4 or 8 bits per voxel;
+    # a chunk of a single id keeps no indices at all. This is the form chunks take in region files and in the
+    # archive of evicted edited columns; resident chunks stay dense for raycasts, edits and meshing
+    def __init__(self, palette, bits, data):
+        self.palette = palette
+        self.bits = bits
+        self.data = data
+
+    @classmethod
+    def from_dense(cls, voxels):
+        palette = np.flatnonzero(np.bincount(voxels, minlength=256)).astype(np.uint8)
+        bits = 0
+        while 1 << bits < len(palette):
+            bits = bits * 2 or 1
+        if not bits:
+            return cls(palette, 0, np.empty(0, dtype=np.uint8))
+        lookup = np.zeros(256, dtype=np.uint8)
+        lookup[palette] = np.arange(len(palette))
+        indices = lookup[voxels].reshape(-1, 8 // bits)
+        shifts = np.arange(0, 8, bits, dtype=np.uint8)
+        return cls(palette, bits, np.bitwise_or.reduce(indices << shifts, axis=1))
+
+    def to_dense(self, out=None):
+        if out is None:
+            out = np.empty(CHUNK_VOL, dtype=np.uint8)
+        if not self.bits:
+            out[:] = self.palette[0]
+            return out
+        shifts = np.arange(0, 8, self.bits, dtype=np.uint8)
+        indices = (self.data[:, None] >> shifts) & ((1 << self.bits) - 1)
+        out[:] = self.palette[indices.ravel()]
+        return out
+
+    @property
+    def nbytes(self):
+        return self.palette.nbytes + self.data.nbytes
+
+############ REGION FILES ############
+
+class RegionStore:
+    # Saved chunks grouped into region files of REGION_SIZE x WORLD_H x REGION_SIZE chunks. Each file starts with
+    # a table of (offset, capacity, bits, palette size) per chunk, followed by the palette-compressed chunks, and is
+    # read through a memmap so loading only pages in the chunks asked for
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.maps = {}
+        # Streaming worlds load columns on worker threads while saves run on the GL thread
+        self.lock = threading.Lock()
+
+    def region_path(self, region):
+        return self.path / f"r.{region[0]}.{region[1]}.region"
+
+    @staticmethod
+    def locate(position):
+        x, y, z = position
+        region = (x // REGION_SIZE, z // REGION_SIZE)
+        return region, x % REGION_SIZE + y * REGION_SIZE + z % REGION_SIZE * REGION_SIZE * WORLD_H
+
+    def region_map(self, region):
+        if region not in self.maps:
+            path = self.region_path(region)
+            self.maps[region] = np.memmap(path, dtype=np.uint8, mode="r") if path.exists() else None
+        return self.maps[region]
+
+    def load(self, position):
+        region, entry = self.locate(position)
+        with self.lock:
+            region_map = self.region_map(region)
+            if region_map is None:
+                return None
+            offset, _, bits, palette_size = (int(value) for value in region_map[:REGION_TABLE_BYTES].view(np.int64)[entry * 4:entry * 4 + 4])
+            if not offset:
+                return None
+            end = offset + palette_size + CHUNK_VOL * bits // 8
+            return PaletteChunk(np.array(region_map[offset:offset + palette_size]), bits, np.array(region_map[offset + palette_size:end]))
+
+    def save(self, chunks):
+        # Rewrite each chunk in place when it still fits its old record, otherwise append it to the file
+        regions = {}
+        for position, chunk in chunks.items():
+            region, entry = self.locate(position)
+            regions.setdefault(region, []).append((entry, chunk))
+        with self.lock:
+            for region, entries in regions.items():
+                path = self.region_path(region)
+                self.maps.pop(region, None)
+                if not path.exists():
+                    path.write_bytes(bytes(REGION_TABLE_BYTES))
+                with open(path, "r+b") as file:
+                    table = np.frombuffer(file.read(REGION_TABLE_BYTES), dtype=np.int64).reshape(REGION_CHUNKS, 4).copy()
+                    end = file.seek(0, os.SEEK_END)
+                    for entry, chunk in entries:
+                        offset, capacity = table[entry, :2]
+                        if chunk.nbytes > capacity:
+                            offset, capacity = end, chunk.nbytes
+                            end += capacity
+                        table[entry] = offset, capacity, chunk.bits, len(chunk.palette)
+                        file.seek(offset)
+                        file.write(chunk.palette.tobytes() + chunk.data.tobytes())
+                    file.seek(0)
+                    file.write(table.tobytes())
 
-@njit
-def get_chunk_index(world_voxel_pos):
+############ MESHING ############
+
+MAX_CHUNK_QUADS = CHUNK_VOL * 3
+
+@njit(cache=True)
+def get_chunk_index(world_voxel_pos, chunk_grid):
+    # chunk_grid holds the origin of the chunk in each slot, indexed [z, y, x]; chunks wrap around it,
+    # so a slot only matches when its origin does
     wx, wy, wz = world_voxel_pos
     cx = wx // CHUNK_SIZE
     cy = wy // CHUNK_SIZE
     cz = wz // CHUNK_SIZE
-    if not (0 <= cx < WORLD_W and 0 <= cy < WORLD_H and 0 <= cz < WORLD_D):
+    depth, height, width = chunk_grid.shape[0], chunk_grid.shape[1], chunk_grid.shape[2]
+    if not 0 <= cy < height:
         return -1
-    return cx + cy * WORLD_W + cz * WORLD_AREA
-
-@njit
-def is_empty(local_voxel_pos, world_voxel_pos, world_voxels):
-    chunk_index = get_chunk_index(world_voxel_pos)
-    if chunk_index == -1:
-        return False
-    chunk_voxels = world_voxels[chunk_index]
-    
-    x, y, z = local_voxel_pos
-    voxel_index = x % CHUNK_SIZE + y % CHUNK_SIZE * CHUNK_SIZE + z % CHUNK_SIZE * CHUNK_AREA
-    if chunk_voxels[voxel_index]:
-        return False
-    return True
-
-@njit
-def construct_chunk_mesh(chunk_voxels, chunk_pos, world_voxels):
-    index = 0
-    vertex_data = np.empty(CHUNK_VOL * 18 * 7, dtype=np.uint8)
+    x, z = cx % width, cz % depth
+    if chunk_grid[z, cy, x, 0] != cx * CHUNK_SIZE or chunk_grid[z, cy, x, 2] != cz * CHUNK_SIZE:
+        return -1
+    return x + cy * width + z * width * height
+
+# Corner offsets (x, y, z, u, v) of each face, in triangle order 0, 1, 2, 2, 3, 0
+FACE_CORNERS = np.array([
+    [[1, 1, 1, 1, 0], [1, 1, 0, 1, 1], [0, 1, 0, 0, 1], [0, 1, 1, 0, 0]],
+    [[1, 0, 0, 1, 0], [1, 0, 1, 1, 1], [0, 0, 1, 0, 1], [0, 0, 0, 0, 0]],
+    [[1, 0, 0, 1, 0], [1, 1, 0, 1, 1], [1, 1, 1, 0, 1], [1, 0, 1, 0, 0]],
+    [[0, 0, 1, 1, 0], [0, 1, 1, 1, 1], [0, 1, 0, 0, 1], [0, 0, 0, 0, 0]],
+    [[1, 0, 1, 1, 0], [1, 1, 1, 1, 1], [0, 1, 1, 0, 1], [0, 0, 1, 0, 0]],
+    [[0, 0, 0, 1, 0], [0, 1, 0, 1, 1], [1, 1, 0, 0, 1], [1, 0, 0, 0, 0]],
+], dtype=np.int64)
+
+FACE_NORMALS = np.array([
+    [0, 1, 0],
+    [0, -1, 0],
+    [1, 0, 0],
+    [-1, 0, 0],
+    [0, 0, 1],
+    [0, 0, -1],
+], dtype=np.int64)
+
+# Normal axis, normal direction, u axis and v axis of each face
+FACE_AXES = np.array([
+    [1, 1, 0, 2],
+    [1, -1, 0, 2],
+    [0, 1, 2, 1],
+    [0, -1, 2, 1],
+    [2, 1, 0, 1],
+    [2, -1, 0, 1],
+], dtype=np.int64)
+
+class MeshScratch(threading.local):
+    # Per-thread buffers for the meshers, so building a mesh only allocates its exact-size result
+    def __init__(self):
+        self.padded = [np.empty((CHUNK_SIZE // scale + 2,) * 3, dtype=np.uint8) for scale in LOD_SCALES]
+        self.padded_light = [np.empty((CHUNK_SIZE // scale + 2,) * 3, dtype=np.uint8) for scale in LOD_SCALES]
+        self.quads = np.empty((MAX_CHUNK_QUADS, 8), dtype=np.uint8)
+        self.vertex_data = np.empty(MAX_CHUNK_QUADS * 4 * 8, dtype=np.uint8)
+        self.border_air = np.empty((6, CHUNK_SIZE, CHUNK_SIZE), dtype=np.bool_)
+
+mesh_scratch = MeshScratch()
+
+@njit(nogil=True, cache=True)
+def build_padded_voxels(chunk_pos, world_voxels, chunk_grid, padded):
+    # The chunk indexed [x, y, z] with a one voxel border from its neighbours; outside the world counts as solid
+    padded[0], padded[-1] = 1, 1
+    padded[:, 0], padded[:, -1] = 1, 1
+    padded[:, :, 0], padded[:, :, -1] = 1, 1
+    cx, cy, cz = chunk_pos
+    chunk_voxels = world_voxels[get_chunk_index((cx * CHUNK_SIZE, cy * CHUNK_SIZE, cz * CHUNK_SIZE), chunk_grid)]
     for x in range(CHUNK_SIZE):
         for y in range(CHUNK_SIZE):
             for z in range(CHUNK_SIZE):
-                voxel_id = chunk_voxels[x + y * CHUNK_SIZE + z * CHUNK_AREA]
+                padded[x + 1, y + 1, z + 1] = chunk_voxels[x + y * CHUNK_SIZE + z * CHUNK_AREA]
+
+    src = np.zeros(3, dtype=np.int64)
+    dst = np.zeros(3, dtype=np.int64)
+    for axis in range(3):
+        u_axis, v_axis = (axis + 1) % 3, (axis + 2) % 3
+        for side in (-1, 1):
+            src[0], src[1], src[2] = cx, cy, cz
+            src[axis] += side
+            neighbour_index = get_chunk_index((src[0] * CHUNK_SIZE, src[1] * CHUNK_SIZE, src[2] * CHUNK_SIZE), chunk_grid)
+            if neighbour_index == -1:
+                continue
+            neighbour_voxels = world_voxels[neighbour_index].reshape((CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE))
+
+            # Copy the facing layer of the neighbour into the border layer on that side
+            src[axis] = CHUNK_SIZE - 1 if side == -1 else 0
+            dst[axis] = 0 if side == -1 else PADDED_SIZE - 1
+            for u in range(CHUNK_SIZE):
+                for v in range(CHUNK_SIZE):
+                    src[u_axis], src[v_axis] = u, v
+                    dst[u_axis], dst[v_axis] = u + 1, v + 1
+                    padded[dst[0], dst[1], dst[2]] = neighbour_voxels[src[2], src[1], src[0]]
+
+@njit(cache=True)
+def majority_voxel(voxels, x0, y0, z0, scale, counts):
+    # The most common solid id in the scale^3 block of [z, y, x] voxels at x0, y0, z0 if at least half of it
+    # is solid, else air; counts is zeroed scratch space for every id
+    solid, best = 0, 0
+    for z in range(z0, z0 + scale):
+        for y in range(y0, y0 + scale):
+            for x in range(x0, x0 + scale):
+                voxel_id = voxels[z, y, x]
+                if voxel_id:
+                    solid += 1
+                    counts[voxel_id] += 1
+                    if counts[voxel_id] > counts[best]:
+                        best = voxel_id
+    for z in range(z0, z0 + scale):
+        for y in range(y0, y0 + scale):
+            for x in range(x0, x0 + scale):
+                counts[voxels[z, y, x]] = 0
+    return best if 2 * solid >= scale ** 3 else 0
+
+@njit(nogil=True, cache=True)
+def build_lod_voxels(chunk_pos, world_voxels, chunk_grid, scale, padded):
+    # The chunk downsampled into cells of scale^3 voxels by majority_voxel, with a solid border like
+    # build_padded_voxels; the border is opened up by seal_lod_borders
+    padded[0], padded[-1] = 1, 1
+    padded[:, 0], padded[:, -1] = 1, 1
+    padded[:, :, 0], padded[:, :, -1] = 1, 1
+    cx, cy, cz = chunk_pos
+    chunk_voxels = world_voxels[get_chunk_index((cx * CHUNK_SIZE, cy * CHUNK_SIZE, cz * CHUNK_SIZE), chunk_grid)]
+    chunk_voxels = chunk_voxels.reshape((CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE))
+    counts = np.zeros(256, dtype=np.int64)
+    size = CHUNK_SIZE // scale
+    for x in range(size):
+        for y in range(size):
+            for z in range(size):
+                padded[x + 1, y + 1, z + 1] = majority_voxel(chunk_voxels, x * scale, y * scale, z * scale, scale, counts)
+
+@njit(nogil=True, cache=True)
+def build_border_air(chunk_pos, world_voxels, chunk_grid, air):
+    # For each face of the chunk, indexed axis * 2 + (side > 0), where the neighbour's layer of cells against it
+    # is air at any LOD scale; missing neighbours are outside the world and count as solid
+    cx, cy, cz = chunk_pos
+    counts = np.zeros(256, dtype=np.int64)
+    src = np.zeros(3, dtype=np.int64)
+    air[:] = False
+    for axis in range(3):
+        u_axis, v_axis = (axis + 1) % 3, (axis + 2) % 3
+        for side in (-1, 1):
+            face = axis * 2 + (side > 0)
+            src[0], src[1], src[2] = cx, cy, cz
+            src[axis] += side
+            neighbour_index = get_chunk_index((src[0] * CHUNK_SIZE, src[1] * CHUNK_SIZE, src[2] * CHUNK_SIZE), chunk_grid)
+            if neighbour_index == -1:
+                continue
+            neighbour_voxels = world_voxels[neighbour_index].reshape((CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE))
+            for level in LOD_SCALES:
+                src[axis] = CHUNK_SIZE - level if side == -1 else 0
+                for u in range(0, CHUNK_SIZE, level):
+                    for v in range(0, CHUNK_SIZE, level):
+                        src[u_axis], src[v_axis] = u, v
+                        if not majority_voxel(neighbour_voxels, src[0], src[1], src[2], level, counts):
+                            for i in range(u, u + level):
+                                for j in range(v, v + level):
+                                    air[face, i, j] = True
+
+@njit(nogil=True, cache=True)
+def seal_lod_borders(air, scale, padded):
+    # Neighbouring chunks can be drawn at other scales, so a border cell only stays solid if the neighbour is
+    # solid against the whole of its face at every scale; faces on the seam are then kept wherever a coarser
+    # or finer neighbour would otherwise leave a gap to see through
+    size = CHUNK_SIZE // scale
+    dst = np.zeros(3, dtype=np.int64)
+    for axis in range(3):
+        u_axis, v_axis = (axis + 1) % 3, (axis + 2) % 3
+        for side in (-1, 1):
+            face = axis * 2 + (side > 0)
+            dst[axis] = 0 if side == -1 else size + 1
+            for u in range(size):
+                for v in range(size):
+                    if air[face, u * scale:(u + 1) * scale, v * scale:(v + 1) * scale].any():
+                        dst[u_axis], dst[v_axis] = u + 1, v + 1
+                        padded[dst[0], dst[1], dst[2]] = 0
+
+@njit(cache=True, inline="always")
+def brightest_light(light, x0, y0, z0, scale):
+    # The brightest sunlight and block light in the scale^3 block of [z, y, x] light at x0, y0, z0
+    if scale == 1:
+        return light[z0, y0, x0]
+    sun, block = 0, 0
+    for z in range(z0, z0 + scale):
+        for y in range(y0, y0 + scale):
+            for x in range(x0, x0 + scale):
+                value = light[z, y, x]
+                sun, block = max(sun, value & 240), max(block, value & 15)
+    return sun | block
+
+@njit(nogil=True, cache=True)
+def build_padded_light(chunk_pos, light, chunk_grid, scale, padded_light):
+    # Light over the padded grid at scale, each cell holding the brightest voxel in it; a face takes the light
+    # of the cell in front of it. Only border cells sharing a face with the chunk are read by the meshers, and
+    # they are filled like build_padded_voxels, one neighbour per face. Outside the world is open sky
+    padded_light[:] = MAX_LIGHT << 4
+    size = CHUNK_SIZE // scale
+    cx, cy, cz = chunk_pos
+    chunk_light = light[get_chunk_index((cx * CHUNK_SIZE, cy * CHUNK_SIZE, cz * CHUNK_SIZE), chunk_grid)]
+    chunk_light = chunk_light.reshape((CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE))
+    for x in range(size):
+        for y in range(size):
+            for z in range(size):
+                padded_light[x + 1, y + 1, z + 1] = brightest_light(chunk_light, x * scale, y * scale, z * scale, scale)
+
+    src = np.zeros(3, dtype=np.int64)
+    dst = np.zeros(3, dtype=np.int64)
+    for axis in range(3):
+        u_axis, v_axis = (axis + 1) % 3, (axis + 2) % 3
+        for side in (-1, 1):
+            src[0], src[1], src[2] = cx, cy, cz
+            src[axis] += side
+            neighbour_index = get_chunk_index((src[0] * CHUNK_SIZE, src[1] * CHUNK_SIZE, src[2] * CHUNK_SIZE), chunk_grid)
+            if neighbour_index == -1:
+                continue
+            neighbour_light = light[neighbour_index].reshape((CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE))
+
+            # The neighbour's layer of cells against this face goes into the border layer on that side
+            src[axis] = CHUNK_SIZE - scale if side == -1 else 0
+            dst[axis] = 0 if side == -1 else size + 1
+            for u in range(size):
+                for v in range(size):
+                    src[u_axis], src[v_axis] = u * scale, v * scale
+                    dst[u_axis], dst[v_axis] = u + 1, v + 1
+                    padded_light[dst[0], dst[1], dst[2]] = brightest_light(neighbour_light, src[0], src[1], src[2], scale)
+
+@njit(cache=True)
+def add_quad(quads, count, x, y, z, width, height, voxel_id, face_id, light):
+    # Quads are (x, y, z, width, height, voxel_id, face_id, light), with width and height along the u and v axes
+    quad = quads[count]
+    quad[0], quad[1], quad[2] = x, y, z
+    quad[3], quad[4] = width, height
+    quad[5], quad[6], quad[7] = voxel_id, face_id, light
+    return count + 1
+
+@njit(cache=True)
+def quad_extent(face_id, width, height):
+    _, _, u_axis, v_axis = FACE_AXES[face_id]
+    ex = width if u_axis == 0 else height if v_axis == 0 else 1
+    ey = width if u_axis == 1 else height if v_axis == 1 else 1
+    ez = width if u_axis == 2 else height if v_axis == 2 else 1
+    return ex, ey, ez
+
+@njit(nogil=True, cache=True)
+def construct_chunk_mesh(padded, padded_light, quads, y_start=0, y_end=CHUNK_SIZE):
+    # One quad per visible voxel face, for the voxels with y_start <= y < y_end; coordinates are in cells
+    # of the padded grid, which is smaller than the chunk for LOD meshes
+    count = 0
+    size = padded.shape[0] - 2
+    for x in range(size):
+        for y in range(y_start, y_end):
+            for z in range(size):
+                voxel_id = padded[x + 1, y + 1, z + 1]
                 if voxel_id:
-                    cx, cy, cz = chunk_pos
-                    wx = x + cx * CHUNK_SIZE
-                    wy = y + cy * CHUNK_SIZE
-                    wz = z + cz * CHUNK_SIZE
-
-                    if is_empty((x, y + 1, z), (wx, wy + 1, wz), world_voxels):
-                        index = add_face(vertex_data, index, 
-                        vertex_to_uint8(x + 1 , y + 1 , z + 1, voxel_id, 0, 1, 0),
-                        vertex_to_uint8(x + 1, y + 1, z, voxel_id, 0, 1, 1),
-                        vertex_to_uint8(x, y + 1, z, voxel_id, 0, 0, 1),
-                        vertex_to_uint8(x, y + 1, z + 1, voxel_id, 0, 0, 0))
-                    if is_empty((x, y - 1, z), (wx, wy - 1, wz), world_voxels):
-                        index = add_face(vertex_data, index, 
-                        vertex_to_uint8(x + 1, y, z, voxel_id, 1, 1, 0),
-                        vertex_to_uint8(x + 1, y, z + 1, voxel_id, 1, 1, 1),
-                        vertex_to_uint8(x, y, z + 1, voxel_id, 1, 0, 1),
-                        vertex_to_uint8(x, y, z, voxel_id, 1, 0, 0))
-                    if is_empty((x + 1, y, z), (wx + 1, wy, wz), world_voxels):
-                        index = add_face(vertex_data, index, 
-                        vertex_to_uint8(x + 1, y, z, voxel_id, 2, 1, 0),
-                        vertex_to_uint8(x + 1, y + 1 , z, voxel_id, 2, 1, 1),
-                        vertex_to_uint8(x + 1, y + 1 , z + 1, voxel_id, 2, 0, 1),
-                        vertex_to_uint8(x + 1, y, z + 1, voxel_id, 2, 0, 0))
-                    if is_empty((x - 1, y, z), (wx - 1, wy, wz), world_voxels):
-                        index = add_face(vertex_data, index, 
-                        vertex_to_uint8(x, y, z + 1, voxel_id, 3, 1, 0),
-                        vertex_to_uint8(x, y + 1, z + 1, voxel_id, 3, 1, 1),
-                        vertex_to_uint8(x, y + 1, z, voxel_id, 3, 0, 1),
-                        vertex_to_uint8(x, y, z, voxel_id, 3, 0, 0))
-                    if is_empty((x, y, z + 1), (wx, wy, wz + 1), world_voxels):
-                        index = add_face(vertex_data, index, 
-                        vertex_to_uint8(x + 1, y, z + 1, voxel_id, 4, 1, 0),
-                        vertex_to_uint8(x + 1, y + 1 , z + 1, voxel_id, 4, 1, 1),
-                        vertex_to_uint8(x, y + 1, z + 1, voxel_id, 4, 0, 1),
-                        vertex_to_uint8(x, y, z + 1, voxel_id, 4, 0, 0))   
-                    if is_empty((x, y, z - 1), (wx, wy, wz - 1), world_voxels):
-                        index = add_face(vertex_data, index, 
-                        vertex_to_uint8(x, y, z, voxel_id, 5, 1, 0),
-                        vertex_to_uint8(x, y + 1, z, voxel_id, 5, 1, 1),
-                        vertex_to_uint8(x + 1 , y + 1 , z, voxel_id, 5, 0, 1),
-                        vertex_to_uint8(x + 1, y, z, voxel_id, 5, 0, 0))
-
-    return vertex_data[:index] if index else None
+                    for face_id in range(6):
+                        dx, dy, dz = FACE_NORMALS[face_id]
+                        if not padded[x + 1 + dx, y + 1 + dy, z + 1 + dz]:
+                            light = padded_light[x + 1 + dx, y + 1 + dy, z + 1 + dz]
+                            count = add_quad(quads, count, x, y, z, 1, 1, voxel_id, face_id, light)
+    return count
+
+@njit(nogil=True, cache=True)
+def construct_chunk_mesh_greedy(padded, padded_light, quads, y_start=0, y_end=CHUNK_SIZE):
+    # Merges coplanar faces with the same voxel id and light into larger quads, for the voxels with y_start <= y < y_end
+    count = 0
+    size = padded.shape[0] - 2
+    mask = np.zeros((size, size), dtype=np.uint16)
+    pos = np.zeros(3, dtype=np.int64)
+    flat = padded.ravel()
+    flat_light = padded_light.ravel()
+    strides = ((size + 2) * (size + 2), size + 2, 1)
+    low = (0, y_start, 0)
+    high = (size, y_end, size)
+    for face_id in range(6):
+        axis, sign, u_axis, v_axis = FACE_AXES[face_id]
+        stride, u_stride, v_stride = strides[axis], strides[u_axis], strides[v_axis]
+        u_low, u_high, v_low, v_high = low[u_axis], high[u_axis], low[v_axis], high[v_axis]
+        for d in range(low[axis], high[axis]):
+            # Mark every visible face in this slice with the id of its voxel and the light in front of it
+            for i in range(u_low, u_high):
+                row = (d + 1) * stride + (i + 1) * u_stride
+                for j in range(v_low, v_high):
+                    voxel_index = row + (j + 1) * v_stride
+                    voxel_id = flat[voxel_index]
+                    if voxel_id and not flat[voxel_index + sign * stride]:
+                        mask[i, j] = voxel_id | np.uint16(flat_light[voxel_index + sign * stride]) << 8
+                    else:
+                        mask[i, j] = 0
+
+            # Merge faces with the same voxel id and light into rectangles, growing along v then u
+            for i in range(u_low, u_high):
+                j = v_low
+                while j < v_high:
+                    face = mask[i, j]
+                    if not face:
+                        j += 1
+                        continue
+                    h = 1
+                    while j + h < v_high and mask[i, j + h] == face:
+                        h += 1
+                    w = 1
+                    while i + w < u_high:
+                        for k in range(h):
+                            if mask[i + w, j + k] != face:
+                                break
+                        else:
+                            w += 1
+                            continue
+                        break
+                    mask[i:i + w, j:j + h] = 0
+
+                    pos[axis] = d
+                    pos[u_axis] = i
+                    pos[v_axis] = j
+                    count = add_quad(quads, count, pos[0], pos[1], pos[2], w, h, face & 255, face_id, face >> 8)
+                    j += h
+
+    return count
+
+@njit(nogil=True, cache=True)
+def write_vertices(quads, count, vertex_data, scale=1):
+    # Four "3u1 1u1 1u1 2u1 1u1" vertices per quad, returning the number of bytes written;
+    # quads in cells of scale voxels are written in voxels
+    index = 0
+    for q in range(count):
+        x, y, z, width, height, voxel_id, face_id, light = quads[q]
+        ex, ey, ez = quad_extent(face_id, width, height)
+        for corner in range(4):
+            ox, oy, oz, u, v = FACE_CORNERS[face_id, corner]
+            vertex_data[index] = (x + ox * ex) * scale
+            vertex_data[index + 1] = (y + oy * ey) * scale
+            vertex_data[index + 2] = (z + oz * ez) * scale
+            vertex_data[index + 3] = voxel_id
+            vertex_data[index + 4] = face_id
+            # Texture coordinates span the whole quad so the shader can tile them per voxel
+            vertex_data[index + 5] = u * width * scale
+            vertex_data[index + 6] = v * height * scale
+            # The light byte also keeps every vertex 4-byte aligned, which GPUs fetch without a slow path
+            vertex_data[index + 7] = light
+            index += 8
+    return index
+
+@njit(nogil=True, cache=True)
+def write_packed_vertices(quads, count, vertex_data, scale=1):
+    # Four uint32 vertices per quad: x, y, z in 6 bits each, voxel_id and face_id in 3 bits each, then the light byte
+    index = 0
+    for q in range(count):
+        x, y, z, width, height, voxel_id, face_id, light = quads[q]
+        ex, ey, ez = quad_extent(face_id, width, height)
+        for corner in range(4):
+            ox, oy, oz, _, _ = FACE_CORNERS[face_id, corner]
+            vx, vy, vz = (x + ox * ex) * scale, (y + oy * ey) * scale, (z + oz * ez) * scale
+            vertex_data[index] = vx | vy << 6 | vz << 12 | voxel_id << 18 | face_id << 21 | np.uint32(light) << 24
+            index += 1
+    return index
+
+def quad_indices(quad_count):
+    # Two triangles per quad of four vertices, shared by every chunk mesh
+    corners = np.array([0, 1, 2, 2, 3, 0], dtype=np.uint32)
+    return (np.arange(quad_count, dtype=np.uint32)[:, None] * 4 + corners).ravel()
 
 ############ VOXEL INTERACTIONS ############
 
-def cast_ray(origin, direction, world_voxels):
-    step = glm.sign(direction)
-    ray_pos = glm.vec3(origin)
-    world_voxel_pos = glm.ivec3(ray_pos)
-    t_max = glm.vec3((step - (ray_pos % 1)) / direction)
-    t_delta = glm.vec3(step / direction)
+@njit(cache=True)
+def get_brick_index(voxel_index):
+    x = voxel_index % CHUNK_SIZE
+    y = voxel_index // CHUNK_SIZE % CHUNK_SIZE
+    z = voxel_index // CHUNK_AREA
+    return x // BRICK_SIZE + y // BRICK_SIZE * BRICK_AXIS + z // BRICK_SIZE * BRICK_AXIS * BRICK_AXIS
+
+def count_brick_voxels(voxels):
+    # Solid voxels in each brick of a stack of chunks, indexed like get_brick_index
+    bricks = voxels.reshape(-1, BRICK_AXIS, BRICK_SIZE, BRICK_AXIS, BRICK_SIZE, BRICK_AXIS, BRICK_SIZE)
+    return np.count_nonzero(bricks, axis=(2, 4, 6)).reshape(-1, CHUNK_BRICKS).astype(np.uint8)
+
+@njit(nogil=True, cache=True)
+def trace_ray(origin, direction, world_voxels, chunk_grid, solid_counts, brick_counts, max_dist, hit_pos, hit_normal):
+    # DDA from origin that crosses empty (or unloaded) chunks and empty bricks in one jump, stepping voxel by
+    # voxel only inside occupied bricks; fills in the solid voxel hit and the normal of the face it was entered
+    # through, returning the distance along the normalised direction, or -1 on a miss within max_dist
+    length = np.sqrt(direction[0] ** 2 + direction[1] ** 2 + direction[2] ** 2)
+    if length == 0:
+        return -1.0
+    d = np.empty(3, dtype=np.float64)
+    voxel = np.empty(3, dtype=np.int64)
+    step = np.empty(3, dtype=np.int64)
+    t_max = np.empty(3, dtype=np.float64)
+    t_delta = np.empty(3, dtype=np.float64)
+    for axis in range(3):
+        d[axis] = direction[axis] / length
+        voxel[axis] = int(np.floor(origin[axis]))
+        if d[axis] > 0:
+            step[axis] = 1
+            t_max[axis] = (voxel[axis] + 1 - origin[axis]) / d[axis]
+            t_delta[axis] = 1 / d[axis]
+        elif d[axis] < 0:
+            step[axis] = -1
+            t_max[axis] = (voxel[axis] - origin[axis]) / d[axis]
+            t_delta[axis] = -1 / d[axis]
+        else:
+            step[axis] = 0
+            t_max[axis] = np.inf
+            t_delta[axis] = np.inf
+
+    t = 0.0
     last_axis = -1
+    while t <= max_dist:
+        chunk_index = get_chunk_index((voxel[0], voxel[1], voxel[2]), chunk_grid)
+        cell_size = 0
+        if chunk_index == -1 or solid_counts[chunk_index] == 0:
+            cell_size = CHUNK_SIZE
+        else:
+            voxel_index = voxel[0] % CHUNK_SIZE + voxel[1] % CHUNK_SIZE * CHUNK_SIZE + voxel[2] % CHUNK_SIZE * CHUNK_AREA
+            if brick_counts[chunk_index, get_brick_index(voxel_index)] == 0:
+                cell_size = BRICK_SIZE
+            elif world_voxels[chunk_index, voxel_index]:
+                hit_pos[:] = voxel
+                hit_normal[:] = 0
+                if last_axis != -1:
+                    hit_normal[last_axis] = -step[last_axis]
+                return t
+
+        if cell_size:
+            # Jump to where the ray leaves the empty cell, then restart the DDA from the voxel it enters
+            t_exit = np.inf
+            for axis in range(3):
+                if step[axis]:
+                    low = voxel[axis] // cell_size * cell_size
+                    bound = low + cell_size if step[axis] > 0 else low
+                    t_axis = (bound - origin[axis]) / d[axis]
+                    if t_axis < t_exit:
+                        t_exit = t_axis
+                        last_axis = axis
+            t = t_exit
+            for axis in range(3):
+                low = voxel[axis] // cell_size * cell_size
+                if axis == last_axis:
+                    voxel[axis] = low + cell_size if step[axis] > 0 else low - 1
+                else:
+                    voxel[axis] = min(max(int(np.floor(origin[axis] + d[axis] * t)), low), low + cell_size - 1)
+                if step[axis]:
+                    t_max[axis] = (voxel[axis] + (step[axis] > 0) - origin[axis]) / d[axis]
+            continue
 
-    for _ in range(MAX_RAY_DIST):
-        chunk_index = get_chunk_index(tuple(world_voxel_pos))
-        if chunk_index != -1:
-            voxel_index = world_voxel_pos.x % CHUNK_SIZE + (world_voxel_pos.y % CHUNK_SIZE) * CHUNK_SIZE + (world_voxel_pos.z % CHUNK_SIZE) * CHUNK_AREA
-            voxel_id = world_voxels[chunk_index][voxel_index]
-            if voxel_id:
-                normal = glm.vec3(0)
-                normal[last_axis] = -step[last_axis]
-                return world_voxel_pos, glm.ivec3(normal)
         # Determine which t_max is the smallest, advancing along that axis
-        if t_max.x < t_max.y and t_max.x < t_max.z:
+        if t_max[0] < t_max[1] and t_max[0] < t_max[2]:
             last_axis = 0
-            world_voxel_pos.x += step.x
-            t_max.x += t_delta.x
-        elif t_max.y < t_max.z:
+        elif t_max[1] < t_max[2]:
             last_axis = 1
-            world_voxel_pos.y += step.y
-            t_max.y += t_delta.y
         else:
             last_axis = 2
-            world_voxel_pos.z += step.z
-            t_max.z += t_delta.z
-    return None, None
+        t = t_max[last_axis]
+        voxel[last_axis] += step[last_axis]
+        t_max[last_axis] += t_delta[last_axis]
+    return -1.0
+
+def cast_ray(origin, direction, world_voxels, chunk_grid, solid_counts, brick_counts, max_dist=MAX_RAY_DIST):
+    hit_pos = np.zeros(3, dtype=np.int64)
+    hit_normal = np.zeros(3, dtype=np.int64)
+    distance = trace_ray(np.asarray(origin, dtype=np.float64), np.asarray(direction, dtype=np.float64),
+                         world_voxels, chunk_grid, solid_counts, brick_counts, max_dist, hit_pos, hit_normal)
+    if distance < 0:
+        return None, None
+    return glm.ivec3(*hit_pos.tolist()), glm.ivec3(*hit_normal.tolist())
+
+@njit(nogil=True, cache=True)
+def cast_rays(origins, directions, world_voxels, chunk_grid, solid_counts, brick_counts, max_dist=MAX_RAY_DIST):
+    # Batch of (N, 3) rays for picking and line of sight queries: hit flags, voxels, normals and distances
+    ray_count = origins.shape[0]
+    hits = np.zeros(ray_count, dtype=np.bool_)
+    hit_pos = np.zeros((ray_count, 3), dtype=np.int64)
+    hit_normals = np.zeros((ray_count, 3), dtype=np.int64)
+    distances = np.full(ray_count, -1.0)
+    for i in range(ray_count):
+        distances[i] = trace_ray(origins[i], directions[i], world_voxels, chunk_grid, solid_counts, brick_counts,
+                                 max_dist, hit_pos[i], hit_normals[i])
+        hits[i] = distances[i] >= 0
+    return hits, hit_pos, hit_normals, distances
+
+############ LIGHTING ############
+
+def sky_light(voxels):
+    # Sunlight for stacks of WORLD_H chunks shaped (n, WORLD_H, CHUNK_VOL), listed bottom to top: full strength
+    # in every voxel with nothing solid above it
+    n = len(voxels)
+    solid = voxels.reshape(n, WORLD_H, CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE) != 0
+    solid = solid.transpose(0, 2, 4, 1, 3).reshape(n, CHUNK_SIZE, CHUNK_SIZE, WORLD_H * CHUNK_SIZE)
+    covered = np.logical_or.accumulate(solid[..., ::-1], axis=-1)[..., ::-1]
+    light = np.where(covered, np.uint8(0), np.uint8(MAX_LIGHT << 4))
+    return light.reshape(n, CHUNK_SIZE, CHUNK_SIZE, WORLD_H, CHUNK_SIZE).transpose(0, 3, 1, 4, 2).reshape(n, WORLD_H, CHUNK_VOL)
+
+@njit(cache=True)
+def push_light(queue, count, x, y, z, value):
+    # Appends to a growable (n, 4) queue of voxel positions and a value, returning the queue and its length
+    if count == len(queue):
+        grown = np.empty((len(queue) * 2, 4), dtype=np.int64)
+        grown[:count] = queue
+        queue = grown
+    queue[count, 0], queue[count, 1], queue[count, 2], queue[count, 3] = x, y, z, value
+    return queue, count + 1
+
+@njit(cache=True)
+def voxel_location(x, y, z, chunk_grid):
+    return get_chunk_index((x, y, z), chunk_grid), x % CHUNK_SIZE + y % CHUNK_SIZE * CHUNK_SIZE + z % CHUNK_SIZE * CHUNK_AREA
+
+@njit(cache=True)
+def neighbour_location(x, y, z, chunk_index, voxel_index, face_id, chunk_grid):
+    # Location of the voxel across face_id from x, y, z, only looking up the chunk when it is in another one
+    dx, dy, dz = FACE_NORMALS[face_id]
+    if (0 <= x % CHUNK_SIZE + dx < CHUNK_SIZE and 0 <= y % CHUNK_SIZE + dy < CHUNK_SIZE
+            and 0 <= z % CHUNK_SIZE + dz < CHUNK_SIZE):
+        return chunk_index, voxel_index + dx + dy * CHUNK_SIZE + dz * CHUNK_AREA
+    return voxel_location(x + dx, y + dy, z + dz, chunk_grid)
+
+@njit(cache=True)
+def touch_light(x, y, z, chunk_index, chunk_grid, touched):
+    # Marks the sections whose faces take their light from the voxel at x, y, z in chunk_index: those of the
+    # voxel's cell in the coarsest LOD and of the cells next to it, as in World.update_voxels
+    touched[chunk_index, y % CHUNK_SIZE // SECTION_HEIGHT] = True
+    cell = LOD_SCALES[-1]
+    low_x, low_y, low_z = x // cell * cell, y // cell * cell, z // cell * cell
+    for i in range(6):
+        px, py, pz = x, y, z
+        if i == 0:
+            px = low_x - 1
+        elif i == 1:
+            px = low_x + cell
+        elif i == 2:
+            py = low_y - 1
+        elif i == 3:
+            py = low_y + cell
+        elif i == 4:
+            pz = low_z - 1
+        else:
+            pz = low_z + cell
+        # Most cells have their neighbours in the same section, which needs no lookup
+        if px // CHUNK_SIZE == x // CHUNK_SIZE and py // SECTION_HEIGHT == y // SECTION_HEIGHT and pz // CHUNK_SIZE == z // CHUNK_SIZE:
+            continue
+        neighbour_index = get_chunk_index((px, py, pz), chunk_grid)
+        if neighbour_index != -1:
+            touched[neighbour_index, py % CHUNK_SIZE // SECTION_HEIGHT] = True
+
+@njit(nogil=True, cache=True)
+def spread_light(world_voxels, light, chunk_grid, queue, count, touched):
+    # Breadth-first flood from the queued voxels through air: light drops by one a step, except full sunlight,
+    # which carries straight down undimmed
+    head = 0
+    while head < count:
+        x, y, z = queue[head, 0], queue[head, 1], queue[head, 2]
+        head += 1
+        chunk_index, voxel_index = voxel_location(x, y, z, chunk_grid)
+        if chunk_index == -1:
+            continue
+        value = light[chunk_index, voxel_index]
+        sun, block = np.int64(value >> 4), np.int64(value & 15)
+        for face_id in range(6):
+            dx, dy, dz = FACE_NORMALS[face_id]
+            nx, ny, nz = x + dx, y + dy, z + dz
+            neighbour_index, neighbour_voxel = neighbour_location(x, y, z, chunk_index, voxel_index, face_id, chunk_grid)
+            if neighbour_index == -1 or world_voxels[neighbour_index, neighbour_voxel]:
+                continue
+            neighbour_value = light[neighbour_index, neighbour_voxel]
+            neighbour_sun, neighbour_block = np.int64(neighbour_value >> 4), np.int64(neighbour_value & 15)
+            new_sun = sun if dy == -1 and sun == MAX_LIGHT else sun - 1
+            if new_sun > neighbour_sun or block - 1 > neighbour_block:
+                light[neighbour_index, neighbour_voxel] = max(new_sun, neighbour_sun) << 4 | max(block - 1, neighbour_block)
+                touch_light(nx, ny, nz, neighbour_index, chunk_grid, touched)
+                queue, count = push_light(queue, count, nx, ny, nz, 0)
+
+@njit(nogil=True, cache=True)
+def unspread_light(world_voxels, light, chunk_grid, queue, count, shift, seeds, seed_count, touched):
+    # Darkens one channel (sunlight at shift 4, block light at 0) wherever it came from the queued voxels, each
+    # queued with the value it lost; brighter voxels met on the way, and emitters, are added to seeds to spread
+    # again, returning seeds and their count
+    head = 0
+    while head < count:
+        x, y, z, old = queue[head, 0], queue[head, 1], queue[head, 2], queue[head, 3]
+        head += 1
+        chunk_index, voxel_index = voxel_location(x, y, z, chunk_grid)
+        for face_id in range(6):
+            dx, dy, dz = FACE_NORMALS[face_id]
+            nx, ny, nz = x + dx, y + dy, z + dz
+            neighbour_index, neighbour_voxel = neighbour_location(x, y, z, chunk_index, voxel_index, face_id, chunk_grid)
+            if neighbour_index == -1:
+                continue
+            neighbour_value = light[neighbour_index, neighbour_voxel]
+            value = np.int64(neighbour_value >> shift & 15)
+            if not value:
+                continue
+            if world_voxels[neighbour_index, neighbour_voxel]:
+                seeds, seed_count = push_light(seeds, seed_count, nx, ny, nz, 0)
+            elif value < old or shift == 4 and dy == -1 and old == MAX_LIGHT:
+                light[neighbour_index, neighbour_voxel] = neighbour_value & (255 ^ 15 << shift)
+                touch_light(nx, ny, nz, neighbour_index, chunk_grid, touched)
+                queue, count = push_light(queue, count, nx, ny, nz, value)
+            else:
+                seeds, seed_count = push_light(seeds, seed_count, nx, ny, nz, 0)
+    return seeds, seed_count
+
+@njit(nogil=True, cache=True)
+def relight_voxels(world_voxels, light, chunk_grid, positions, touched):
+    # Updates the light after the voxels at positions changed: the light they held or passed on is taken back,
+    # then the light around them spreads in again, so only the region their light reached is visited
+    opened = np.zeros(len(positions), dtype=np.bool_)
+    sun_queue = np.empty((64, 4), dtype=np.int64)
+    block_queue = np.empty((64, 4), dtype=np.int64)
+    seeds = np.empty((64, 4), dtype=np.int64)
+    sun_count, block_count, seed_count = 0, 0, 0
+    top = chunk_grid.shape[1] * CHUNK_SIZE
+    for i in range(len(positions)):
+        x, y, z = positions[i, 0], positions[i, 1], positions[i, 2]
+        chunk_index, voxel_index = voxel_location(x, y, z, chunk_grid)
+        if chunk_index == -1:
+            continue
+        old = light[chunk_index, voxel_index]
+        voxel_id = world_voxels[chunk_index, voxel_index]
+        emission = LIGHT_EMISSION[voxel_id]
+        light[chunk_index, voxel_index] = emission
+        touch_light(x, y, z, chunk_index, chunk_grid, touched)
+        if old >> 4:
+            sun_queue, sun_count = push_light(sun_queue, sun_count, x, y, z, old >> 4)
+        if old & 15 > emission:
+            block_queue, block_count = push_light(block_queue, block_count, x, y, z, old & 15)
+        if emission:
+            seeds, seed_count = push_light(seeds, seed_count, x, y, z, 0)
+        opened[i] = not voxel_id
+    seeds, seed_count = unspread_light(world_voxels, light, chunk_grid, sun_queue, sun_count, 4, seeds, seed_count, touched)
+    seeds, seed_count = unspread_light(world_voxels, light, chunk_grid, block_queue, block_count, 0, seeds, seed_count, touched)
+    # Voxels that are now air take the light of their brightest neighbours and only spread on if lit, which
+    # keeps large carves from queueing every voxel around them
+    for i in np.flatnonzero(opened):
+        x, y, z = positions[i, 0], positions[i, 1], positions[i, 2]
+        chunk_index, voxel_index = voxel_location(x, y, z, chunk_grid)
+        sun = MAX_LIGHT if y == top - 1 else 0
+        block = 0
+        for face_id in range(6):
+            neighbour_index, neighbour_voxel = neighbour_location(x, y, z, chunk_index, voxel_index, face_id, chunk_grid)
+            if neighbour_index == -1:
+                continue
+            value = np.int64(light[neighbour_index, neighbour_voxel])
+            above = FACE_NORMALS[face_id, 1] == 1
+            sun = max(sun, value >> 4 if above and value >> 4 == MAX_LIGHT else (value >> 4) - 1)
+            block = max(block, (value & 15) - 1)
+        if sun or block:
+            light[chunk_index, voxel_index] = sun << 4 | block
+            seeds, seed_count = push_light(seeds, seed_count, x, y, z, 0)
+    spread_light(world_voxels, light, chunk_grid, seeds, seed_count, touched)
+
+@njit(nogil=True, cache=True)
+def seed_light(world_voxels, light, chunk_grid, chunk_indices, origins):
+    # Queues the voxels light has to spread from once sky_light has lit the chunks: emitters and lit neighbours
+    # of shaded air
+    queue = np.empty((64, 4), dtype=np.int64)
+    count = 0
+    for i in range(len(chunk_indices)):
+        chunk_index = chunk_indices[i]
+        chunk_voxels, chunk_light = world_voxels[chunk_index], light[chunk_index]
+        ox, oy, oz = origins[i]
+        for voxel_index in range(CHUNK_VOL):
+            voxel_id = chunk_voxels[voxel_index]
+            # Most voxels are plain solid or in full sunlight, which need nothing
+            if voxel_id and not LIGHT_EMISSION[voxel_id] or not voxel_id and chunk_light[voxel_index] >> 4 == MAX_LIGHT:
+                continue
+            vx, vy, vz = voxel_index % CHUNK_SIZE, voxel_index // CHUNK_SIZE % CHUNK_SIZE, voxel_index // CHUNK_AREA
+            x, y, z = ox + vx, oy + vy, oz + vz
+            if voxel_id:
+                chunk_light[voxel_index] = LIGHT_EMISSION[voxel_id]
+                queue, count = push_light(queue, count, x, y, z, 0)
+            else:
+                for face_id in range(6):
+                    dx, dy, dz = FACE_NORMALS[face_id]
+                    neighbour_index, neighbour_voxel = neighbour_location(x, y, z, chunk_index, voxel_index, face_id, chunk_grid)
+                    if neighbour_index != -1 and light[neighbour_index, neighbour_voxel]:
+                        queue, count = push_light(queue, count, x + dx, y + dy, z + dz, 0)
+    return queue, count
+
+@njit(nogil=True, cache=True)
+def seed_border_light(world_voxels, light, chunk_grid, chunk_indices, origins):
+    # Queues the lit voxels on both sides of the x and z borders of chunks that were lit on their own, so light
+    # crosses between them and their neighbours once they are in the world
+    queue = np.empty((64, 4), dtype=np.int64)
+    count = 0
+    for i in range(len(chunk_indices)):
+        chunk_index = chunk_indices[i]
+        ox, oy, oz = origins[i]
+        for face_id in range(2, 6):
+            dx, dy, dz = FACE_NORMALS[face_id]
+            edge = CHUNK_SIZE - 1 if FACE_AXES[face_id, 1] == 1 else 0
+            for u in range(CHUNK_SIZE):
+                for vy in range(CHUNK_SIZE):
+                    vx, vz = (edge, u) if FACE_AXES[face_id, 0] == 0 else (u, edge)
+                    voxel_index = vx + vy * CHUNK_SIZE + vz * CHUNK_AREA
+                    x, y, z = ox + vx, oy + vy, oz + vz
+                    if light[chunk_index, voxel_index]:
+                        queue, count = push_light(queue, count, x, y, z, 0)
+                    neighbour_index, neighbour_voxel = neighbour_location(x, y, z, chunk_index, voxel_index, face_id, chunk_grid)
+                    if neighbour_index != -1 and light[neighbour_index, neighbour_voxel]:
+                        queue, count = push_light(queue, count, x + dx, y + dy, z + dz, 0)
+    return queue, count
+
+############ CULLING ############
+
+def frustum_planes(m_proj, m_camera):
+    # Gribb-Hartmann planes (a, b, c, d) of the view frustum with inward normals: left, right, bottom, top, near, far.
+    # The camera's pyrr matrices are laid out for row vectors, so the clip matrix is the transpose of their product
+    m = np.array(m_proj * m_camera, dtype=np.float64).T
+    return np.array([m[3] + m[0], m[3] - m[0], m[3] + m[1], m[3] - m[1], m[3] + m[2], m[3] - m[2]])
+
+def boxes_in_frustum(planes, box_min, box_max):
+    # A box is outside when it lies fully behind any one plane
+    centre = (box_min + box_max) * 0.5
+    half_size = (box_max - box_min) * 0.5
+    distance = centre @ planes[:, :3].T + planes[:, 3]
+    radius = half_size @ np.abs(planes[:, :3]).T
+    return np.all(distance + radius >= 0, axis=1)
+
+############ GPU BUFFER ARENA ############
+
+class ArenaBlock:
+    def __init__(self, offset, size):
+        self.offset = offset
+        self.size = size
+
+class BufferArena:
+    # One GPU buffer shared by every chunk mesh, handed out in whole vertices from a free list
+    def __init__(self, ctx, stride, capacity=ARENA_CAPACITY):
+        self.ctx = ctx
+        self.stride = stride
+        self.capacity = capacity
+        self.buffer = ctx.buffer(reserve=capacity * stride, dynamic=True)
+        self.free_blocks = [[0, capacity]]
+        self.blocks = set()
+        # Bumped whenever blocks move, so anything bound to an old offset can rebind
+        self.version = 0
+
+    def allocate(self, size):
+        for i, (offset, free_size) in enumerate(self.free_blocks):
+            if free_size >= size:
+                if free_size == size:
+                    del self.free_blocks[i]
+                else:
+                    self.free_blocks[i] = [offset + size, free_size - size]
+                block = ArenaBlock(offset, size)
+                self.blocks.add(block)
+                return block
+
+        # No free run is big enough: compacting is enough if the free space adds up, otherwise grow
+        capacity = self.capacity
+        while capacity - self.used_size() < size:
+            capacity *= 2
+        self.rebuild(capacity)
+        return self.allocate(size)
+
+    def free(self, block):
+        self.blocks.discard(block)
+        self.release(block.offset, block.size)
+
+    def release(self, offset, size):
+        free_blocks = self.free_blocks
+        i = bisect.bisect(free_blocks, [offset, size])
+        if i < len(free_blocks) and offset + size == free_blocks[i][0]:
+            size += free_blocks.pop(i)[1]
+        if i > 0 and free_blocks[i - 1][0] + free_blocks[i - 1][1] == offset:
+            free_blocks[i - 1][1] += size
+        else:
+            free_blocks.insert(i, [offset, size])
+
+    def resize(self, block, size):
+        # Shrinking keeps the block in place, growing may move it
+        if size <= block.size:
+            if size < block.size:
+                self.release(block.offset + size, block.size - size)
+                block.size = size
+            return block
+        self.free(block)
+        return self.allocate(size)
+
+    def write(self, block, data):
+        self.buffer.write(data, offset=block.offset * self.stride)
+
+    def rebuild(self, capacity):
+        # Copy every block to the front of a new buffer, leaving a single free run after them
+        buffer = self.ctx.buffer(reserve=capacity * self.stride, dynamic=True)
+        offset = 0
+        for block in sorted(self.blocks, key=lambda block: block.offset):
+            self.ctx.copy_buffer(buffer, self.buffer, block.size * self.stride,
+                                 read_offset=block.offset * self.stride, write_offset=offset * self.stride)
+            block.offset = offset
+            offset += block.size
+        self.buffer.release()
+        self.buffer = buffer
+        self.capacity = capacity
+        self.free_blocks = [[offset, capacity - offset]] if offset < capacity else []
+        self.version += 1
+
+    def used_size(self):
+        return self.capacity - sum(size for _, size in self.free_blocks)
+
+    def stats(self):
+        free = self.capacity - self.used_size()
+        largest_free = max((size for _, size in self.free_blocks), default=0)
+        return {
+            "capacity": self.capacity * self.stride,
+            "used": (self.capacity - free) * self.stride,
+            "free": free * self.stride,
+            "largest_free": largest_free * self.stride,
+            "blocks": len(self.blocks),
+            "fragmentation": 1 - largest_free / free if free else 0.0,
+        }
+
+############ PROFILER ############
+
+class Profiler:
+    # Time spent in named scopes, totalled per frame into a ring of the last PROFILE_FRAMES frames. Scopes may
+    # nest, and may run on any thread; with a context, GPU scopes are also timed with timer queries
+    def __init__(self, ctx=None, frames=PROFILE_FRAMES, events=PROFILE_EVENTS):
+        self.ctx = ctx
+        self.frames = frames
+        self.samples = {}
+        self.frame_totals = {}
+        self.frame_count = 0
+        self.frame_start = perf_counter()
+        self.start = self.frame_start
+        # Every scope as (name, thread, start, duration), for the trace
+        self.events = deque(maxlen=events)
+        self.pending_queries = deque()
+        self.free_queries = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def scope(self, name, gpu=False):
+        # GL timer queries cannot nest, so only one GPU scope may be open at a time
+        start = perf_counter()
+        if gpu and self.ctx:
+            query = self.free_queries.pop() if self.free_queries else self.ctx.query(time=True)
+            with query:
+                yield
+            self.pending_queries.append((self.frame_count, name + " (gpu)", start, query))
+        else:
+            yield
+        self.record(name, start, perf_counter() - start)
+
+    def timed(self, name, function):
+        # Wraps function in a scope, for work handed to the thread pool
+        def run(*args):
+            with self.scope(name):
+                return function(*args)
+        return run
+
+    def record(self, name, start, duration, thread=None):
+        with self.lock:
+            self.frame_totals[name] = self.frame_totals.get(name, 0.0) + duration
+            self.events.append((name, thread or threading.current_thread().name, start, duration))
+
+    def end_frame(self):
+        # GPU times are read PROFILE_GPU_LATENCY frames late, so they land in the frame they are read in
+        while self.pending_queries and self.pending_queries[0][0] <= self.frame_count - PROFILE_GPU_LATENCY:
+            _, name, start, query = self.pending_queries.popleft()
+            self.record(name, start, query.elapsed / 1e9, thread="GPU")
+            self.free_queries.append(query)
+        now = perf_counter()
+        self.record("frame", self.frame_start, now - self.frame_start)
+        self.frame_start = now
+        with self.lock:
+            slot = self.frame_count % self.frames
+            for name in self.samples.keys() | self.frame_totals.keys():
+                # Scopes first seen this frame have no samples before it, which the percentiles skip
+                samples = self.samples.setdefault(name, np.full(self.frames, np.nan))
+                samples[slot] = self.frame_totals.get(name, 0.0)
+            self.frame_totals.clear()
+            self.frame_count += 1
+
+    def stats(self):
+        # Per-frame milliseconds of each scope over the frames kept
+        stats = {}
+        with self.lock:
+            for name, samples in sorted(self.samples.items()):
+                samples = samples[~np.isnan(samples)] * 1000
+                p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+                stats[name] = {"p50": p50, "p95": p95, "p99": p99, "max": samples.max(), "frames": len(samples)}
+        return stats
+
+    def save_json(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({"frames": self.frame_count, "scopes_ms": self.stats()}, indent=2))
+
+    def save_trace(self, path):
+        # Chrome trace event format, for chrome://tracing or Perfetto, with one track per thread
+        with self.lock:
+            events = list(self.events)
+        threads = {}
+        trace = []
+        for name, thread, start, duration in events:
+            if thread not in threads:
+                threads[thread] = len(threads)
+                trace.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": threads[thread], "args": {"name": thread}})
+            trace.append({"name": name, "ph": "X", "pid": 0, "tid": threads[thread],
+                          "ts": (start - self.start) * 1e6, "dur": duration * 1e6})
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({"traceEvents": trace, "displayTimeUnit": "ms"}))
 
 ############ MESH CLASS ############
 
 class ChunkMesh:
-    def __init__(self, chunk):
-        self.vertex_data = None
-        self.index = 0
+    # Chunks are meshed in horizontal sections of SECTION_HEIGHT voxels at every LOD scale, each with its own
+    # arena block, so an edit only remeshes and uploads the sections it can change
+    def __init__(self, chunk, greedy=GREEDY_MESHING):
+        self.vertex_data = [[None] * CHUNK_SECTIONS for _ in LOD_SCALES]
+        self.greedy = greedy
+        self.packed = PACKED_VERTICES
+        self.index = chunk.index
         self.app = chunk.app
         self.chunk = chunk
-        self.ctx = self.app.ctx
-        self.program = self.app.program
+        self.world = chunk.world
+        self.arena = chunk.world.arena
+        self.blocks = [[None] * CHUNK_SECTIONS for _ in LOD_SCALES]
+        # (lod, section) pairs meshed since their last upload
+        self.dirty_sections = set()
 
-        self.vbo_format = "3u1 1u1 1u1 2u1"
-        self.format_size = sum(int(fmt[:1]) for fmt in self.vbo_format.split())
-        self.attrs = ("in_position", "voxel_id", "face_id", "in_texcoord")
-        self.vao = None
+    def build_mesh(self, sections=range(CHUNK_SECTIONS)):
+        self.set_sections(self.mesh_sections(sections))
 
-    def build_mesh(self):
-        self.vertex_data = construct_chunk_mesh(self.chunk.voxels, self.chunk.position, self.chunk.world.voxels)
+    def mesh_sections(self, sections):
+        # The vertex data of each section at each LOD, leaving the mesh untouched so it can run on a worker thread.
+        # Empty and buried chunks have no visible faces, so skip padding and meshing them
+        if not self.world.needs_mesh(self.index):
+            return {(lod, section): None for lod in range(len(LOD_SCALES)) for section in range(CHUNK_SECTIONS)}
+        scratch = mesh_scratch
+        section_data = {}
+        if len(LOD_SCALES) > 1:
+            build_border_air(self.chunk.position, self.world.voxels, self.world.chunk_grid, scratch.border_air)
+        for lod, scale in enumerate(LOD_SCALES):
+            padded = scratch.padded[lod]
+            if scale == 1:
+                build_padded_voxels(self.chunk.position, self.world.voxels, self.world.chunk_grid, padded)
+            else:
+                build_lod_voxels(self.chunk.position, self.world.voxels, self.world.chunk_grid, scale, padded)
+            if len(LOD_SCALES) > 1:
+                seal_lod_borders(scratch.border_air, scale, padded)
+            padded_light = scratch.padded_light[lod]
+            build_padded_light(self.chunk.position, self.world.light, self.world.chunk_grid, scale, padded_light)
+            for section in sections:
+                section_data[(lod, section)] = self.build_section(scratch, padded, padded_light, scale, section)
+        return section_data
 
-    def build_vao(self):
-        if self.vertex_data is not None:
-            vbo = self.ctx.buffer(self.vertex_data)
-            self.vao = self.ctx.vertex_array(
-                self.program,
-                [(vbo, self.vbo_format, *self.attrs)],
-                skip_errors=True
-            )
+    def build_section(self, scratch, padded, padded_light, scale, section):
+        y_start = section * SECTION_HEIGHT // scale
+        y_end = (section + 1) * SECTION_HEIGHT // scale
+        mesher = construct_chunk_mesh_greedy if self.greedy else construct_chunk_mesh
+        quad_count = mesher(padded, padded_light, scratch.quads, y_start, y_end)
+        if self.packed:
+            vertex_data = scratch.vertex_data.view(np.uint32)
+            index = write_packed_vertices(scratch.quads, quad_count, vertex_data, scale)
+        else:
+            vertex_data = scratch.vertex_data
+            index = write_vertices(scratch.quads, quad_count, vertex_data, scale)
+        return vertex_data[:index].copy() if index else None
 
-    def render(self):
-        if self.vao: self.vao.render()
+    def set_sections(self, section_data):
+        for (lod, section), vertex_data in section_data.items():
+            self.vertex_data[lod][section] = vertex_data
+        self.dirty_sections.update(section_data)
+
+    def build_vao(self):
+        # Upload each rebuilt section into its block of the world arena, reusing the block when the mesh still fits
+        sections, self.dirty_sections = self.dirty_sections, set()
+        for lod, section in sections:
+            draw_index = self.index * CHUNK_SECTIONS + section
+            vertex_data = self.vertex_data[lod][section]
+            block = self.blocks[lod][section]
+            if vertex_data is None:
+                if block:
+                    self.arena.free(block)
+                    self.blocks[lod][section] = None
+                self.world.draw_count[lod, draw_index] = 0
+                continue
+            vertex_count = vertex_data.nbytes // self.arena.stride
+            if block:
+                block = self.arena.resize(block, vertex_count)
+            else:
+                block = self.arena.allocate(vertex_count)
+            self.blocks[lod][section] = block
+            self.arena.write(block, vertex_data)
+            self.world.draw_first[lod, draw_index] = block.offset
+            self.world.draw_count[lod, draw_index] = block.size
 
-############ CHUNKS ############
+    def clear(self):
+        self.vertex_data = [[None] * CHUNK_SECTIONS for _ in LOD_SCALES]
+        self.dirty_sections.update((lod, section) for lod in range(len(LOD_SCALES)) for section in range(CHUNK_SECTIONS))
+        self.build_vao()
 
 class Chunk:
-    def __init__(self, world, position):
+    def __init__(self, world, position, index):
         self.app = world.app
         self.world = world
         self.position = position
-        self.m_model = glm.translate(glm.mat4(), glm.vec3(self.position) * CHUNK_SIZE)
+        self.index = index
         self.voxels = None
         self.mesh = ChunkMesh(chunk=self)
 
-    def build_voxels(self):
-        voxels = np.zeros(CHUNK_VOL, dtype=np.uint8)
-
-        cx, cy, cz = glm.ivec3(self.position) * CHUNK_SIZE
-        for x in range(CHUNK_SIZE):
-            for z in range(CHUNK_SIZE):
-                wx = x + cx
-                wz = z + cz
-                world_height = int(glm.simplex(glm.vec2(wx, wz) * 0.01) * 32 + 32)
-                local_height = min(world_height - cy, CHUNK_SIZE)
-
-                for y in range(local_height):
-                    voxels[x + y * CHUNK_SIZE + z * CHUNK_AREA] = 6
-
-        return voxels
-    
-    def render(self):
-        self.mesh.program["m_model"].write(self.m_model)
-        self.mesh.render()
-
 ############ WORLD ############
 
 class World:
-    def __init__(self, app):
+    def __init__(self, app, size=(WORLD_W, WORLD_H, WORLD_D), store=None, workers=MESH_WORKERS, profiler=None):
         self.app = app
-        self.chunks = [None for _ in range(WORLD_VOL)]
-        self.voxels = np.empty((WORLD_VOL, CHUNK_VOL), dtype=np.uint8)
+        self.size = size
+        self.store = store
+        self.profiler = profiler or Profiler()
+        # Chunks whose voxels differ from what is saved: edited or never saved
+        self.dirty_chunks = set()
+        width, height, depth = size
+        chunk_count = width * height * depth
+        self.chunks = [None for _ in range(chunk_count)]
+        self.voxels = np.empty((chunk_count, CHUNK_VOL), dtype=np.uint8)
+        self.light = np.zeros((chunk_count, CHUNK_VOL), dtype=np.uint8)
         self.world_voxel_pos_selection, self.normal_selection = None, None
+        # Bumped by every change a ray can hit, the selection is only cast again when it or the camera moves
+        self.edit_generation = 0
+        self.selection_key = None
+
+        # Every chunk mesh lives in one arena and the world is drawn with a single indirect call
+        ctx = self.app.ctx
+        self.indirect_draws = ctx.version_code >= INDIRECT_DRAW_VERSION
+        if PACKED_VERTICES:
+            self.vbo_format, self.attrs, stride = "1u4", ("packed_data",), 4
+        else:
+            self.vbo_format, self.attrs, stride = "3u1 1u1 1u1 2u1 1u1", ("in_position", "voxel_id", "face_id", "in_texcoord", "in_light"), 8
+        self.quad_ibo = ctx.buffer(quad_indices(MAX_CHUNK_QUADS))
+        self.arena = BufferArena(ctx, stride=stride)
+        self.chunk_origins = ctx.buffer(reserve=chunk_count * 12)
+        self.indirect = ctx.buffer(reserve=chunk_count * CHUNK_SECTIONS * 20, dynamic=True)
+        # Draw ranges per LOD and chunk section, indexed [lod, chunk_index * CHUNK_SECTIONS + section]
+        self.draw_first = np.zeros((len(LOD_SCALES), chunk_count * CHUNK_SECTIONS), dtype=np.int64)
+        self.draw_count = np.zeros((len(LOD_SCALES), chunk_count * CHUNK_SECTIONS), dtype=np.int64)
+        self.chunk_min = np.zeros((chunk_count, 3), dtype=np.float64)
+        self.chunk_grid = self.chunk_min.reshape(depth, height, width, 3)
+        self.solid_counts = np.zeros(chunk_count, dtype=np.int64)
+        self.brick_counts = np.zeros((chunk_count, CHUNK_BRICKS), dtype=np.uint8)
+        self.frustum_culling = True
+        self.sections_drawn, self.sections_culled = 0, 0
+        # Edited sections wait in dirty_sections until their chunk has no remesh job in flight
+        self.dirty_sections = {}
+        self.remesh_jobs = {}
+        # Light is updated by one job at a time on the pool; edited voxels and newly loaded chunks queue up
+        # for the next while it runs
+        self.light_edits = []
+        self.light_chunks = []
+        self.light_job = None
+        self.relighting_edits = False
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.vao = None
+        self.vao_version = -1
+
         self.build_chunks()
         self.build_chunk_meshes()
 
     def build_chunks(self):
+        # Saved chunks are read back from the region files, the terrain is only generated for the rest
+        saved = {}
+        if self.store:
+            for x in range(WORLD_W):
+                for y in range(WORLD_H):
+                    for z in range(WORLD_D):
+                        saved[(x, y, z)] = self.store.load((x, y, z))
+        if None in saved.values() or not saved:
+            self.voxels[:] = generate_terrain(0, 0, WORLD_W, WORLD_D).reshape(WORLD_VOL, CHUNK_VOL)
         for x in range(WORLD_W):
             for y in range(WORLD_H):
                 for z in range(WORLD_D):
-                    chunk = Chunk(world=self, position=(x, y, z))
                     chunk_index = x + y * WORLD_W + z * WORLD_AREA
+                    chunk = Chunk(world=self, position=(x, y, z), index=chunk_index)
                     self.chunks[chunk_index] = chunk
-                    self.voxels[chunk_index] = chunk.build_voxels()
                     chunk.voxels = self.voxels[chunk_index]
+                    if saved.get(chunk.position):
+                        saved[chunk.position].to_dense(chunk.voxels)
+                    else:
+                        self.dirty_chunks.add(chunk.position)
+        self.chunk_min[:] = np.array([chunk.position for chunk in self.chunks]) * CHUNK_SIZE
+        self.chunk_origins.write(self.chunk_min.astype(np.int32))
+        self.solid_counts[:] = np.count_nonzero(self.voxels, axis=1)
+        self.brick_counts[:] = count_brick_voxels(self.voxels)
+        self.light_columns(np.arange(WORLD_VOL).reshape(WORLD_D, WORLD_H, WORLD_W).transpose(0, 2, 1).reshape(-1, WORLD_H))
+
+    def light_columns(self, columns):
+        # Lights columns of chunk indices, each listed bottom to top, from scratch: sunlight falls straight down
+        # until something solid, then floods sideways into shade along with the light of emitters. Returns the
+        # sections whose light changed
+        self.light[columns] = sky_light(self.voxels[columns])
+        chunk_indices = columns.ravel()
+        queue, count = seed_light(self.voxels, self.light, self.chunk_grid, chunk_indices,
+                                  self.chunk_min[chunk_indices].astype(np.int64))
+        touched = np.zeros((len(self.chunks), CHUNK_SECTIONS), dtype=np.bool_)
+        spread_light(self.voxels, self.light, self.chunk_grid, queue, count, touched)
+        return touched
+
+    def relight(self, positions):
+        # Queues voxels that were just edited for the light around them to be updated; the sections it changes
+        # are remeshed once the job is done
+        self.light_edits.append(np.array(positions, dtype=np.int64).reshape(-1, 3))
+
+    def collect_light(self):
+        # Remeshes the sections a finished light job changed; returns whether no job is running
+        if self.light_job and self.light_job.done():
+            self.update_touched(self.light_job.result())
+            self.light_job = None
+        return self.light_job is None
+
+    def update_light(self):
+        # Starts the next light job with everything queued since the last one, once that is done
+        if self.collect_light() and (self.light_edits or self.light_chunks):
+            positions = np.concatenate(self.light_edits or [np.empty((0, 3), dtype=np.int64)])
+            chunk_indices = np.concatenate(self.light_chunks or [np.empty(0, dtype=np.int64)])
+            self.light_edits, self.light_chunks = [], []
+            self.relighting_edits = len(positions) > 0
+            job = self.profiler.timed("light", self.spread_queued_light)
+            self.light_job = self.pool.submit(job, positions, chunk_indices, self.chunk_min[chunk_indices].astype(np.int64))
+
+    def spread_queued_light(self, positions, chunk_indices, origins):
+        # Light crosses into and out of newly loaded chunks first, then the light around edited voxels is redone
+        touched = np.zeros((len(self.chunks), CHUNK_SECTIONS), dtype=np.bool_)
+        queue, count = seed_border_light(self.voxels, self.light, self.chunk_grid, chunk_indices, origins)
+        spread_light(self.voxels, self.light, self.chunk_grid, queue, count, touched)
+        relight_voxels(self.voxels, self.light, self.chunk_grid, positions, touched)
+        return touched
+
+    def update_touched(self, touched):
+        for chunk_index in np.flatnonzero(touched.any(axis=1)):
+            self.update_chunk(chunk_index, np.flatnonzero(touched[chunk_index]))
+
+    def mark_edited(self, chunk_index):
+        self.dirty_chunks.add(self.chunks[chunk_index].position)
+
+    def chunk_at(self, position):
+        x, y, z = position
+        chunk_index = get_chunk_index((x * CHUNK_SIZE, y * CHUNK_SIZE, z * CHUNK_SIZE), self.chunk_grid)
+        return self.chunks[chunk_index] if chunk_index != -1 else None
+
+    def saved_chunk(self, position):
+        chunk = self.chunk_at(position)
+        return PaletteChunk.from_dense(chunk.voxels) if chunk else None
+
+    def save(self):
+        if not self.store:
+            return
+        chunks = {position: self.saved_chunk(position) for position in self.dirty_chunks}
+        self.store.save({position: chunk for position, chunk in chunks.items() if chunk})
+        self.dirty_chunks.clear()
+
+    def is_empty(self, chunk_index):
+        return self.solid_counts[chunk_index] == 0
+
+    def is_full(self, chunk_index):
+        return self.solid_counts[chunk_index] == CHUNK_VOL
+
+    def is_buried(self, chunk_index):
+        # A full chunk is hidden when every neighbour is full too; outside the world counts as solid
+        if not self.is_full(chunk_index):
+            return False
+        x, y, z = self.chunks[chunk_index].position
+        for dx, dy, dz in FACE_NORMALS:
+            neighbour_index = get_chunk_index(((x + dx) * CHUNK_SIZE, (y + dy) * CHUNK_SIZE, (z + dz) * CHUNK_SIZE), self.chunk_grid)
+            if neighbour_index != -1 and not self.is_full(neighbour_index):
+                return False
+        return True
+
+    def needs_mesh(self, chunk_index):
+        return not self.is_empty(chunk_index) and not self.is_buried(chunk_index)
 
     def build_chunk_meshes(self):
-        for chunk in self.chunks:
-            chunk.mesh.build_mesh()
-            chunk.mesh.build_vao()
+        # The meshers release the GIL, so chunks mesh in parallel; VAOs must be made on the GL thread
+        for _ in self.pool.map(self.profiler.timed("mesh", lambda chunk: chunk.mesh.build_mesh()), self.chunks):
+            pass
+        with self.profiler.scope("upload"):
+            for chunk in self.chunks:
+                chunk.mesh.build_vao()
 
-    def update_chunk(self, chunk_index):
+    def update_chunk(self, chunk_index, sections=range(CHUNK_SECTIONS)):
+        # Marks sections for remeshing, which happens once however many edits touched them
         if chunk_index != -1:
-            chunk = self.chunks[chunk_index]
-            chunk.mesh.build_mesh()
-            chunk.mesh.build_vao()
+            self.dirty_sections.setdefault(chunk_index, set()).update(sections)
+
+    def submit_remesh_jobs(self):
+        # One job per chunk at a time, so a chunk's meshes are always uploaded in the order they were made;
+        # sections edited while a job runs are remeshed by the next one. Edits wait for their light job, so
+        # opened voxels are not drawn dark in between
+        if self.light_edits or self.light_job and self.relighting_edits:
+            return
+        for chunk_index in list(self.dirty_sections):
+            if chunk_index not in self.remesh_jobs:
+                chunk = self.chunks[chunk_index]
+                sections = sorted(self.dirty_sections.pop(chunk_index))
+                job = self.profiler.timed("mesh", chunk.mesh.mesh_sections)
+                self.remesh_jobs[chunk_index] = (chunk, self.pool.submit(job, sections))
+
+    def upload_meshes(self, budget_ms=MESH_UPLOAD_BUDGET_MS):
+        # Uploads finished remesh jobs until the budget is spent, at least one per call so edits always
+        # appear; the rest wait for the next frame, keeping frame time bounded however much was edited
+        deadline = perf_counter() + budget_ms / 1000
+        self.update_light()
+        for chunk_index, (chunk, future) in list(self.remesh_jobs.items()):
+            if perf_counter() > deadline:
+                break
+            if future.done():
+                del self.remesh_jobs[chunk_index]
+                # The chunk may have been unloaded while it was meshed
+                if self.chunks[chunk_index] is chunk:
+                    with self.profiler.scope("upload"):
+                        chunk.mesh.set_sections(future.result())
+                        chunk.mesh.build_vao()
+        self.submit_remesh_jobs()
+
+    def finish_meshes(self):
+        # Relights, remeshes and uploads every edited section before returning
+        while self.light_job or self.light_edits or self.light_chunks or self.dirty_sections or self.remesh_jobs:
+            if self.light_job:
+                self.light_job.result()
+            for _, future in self.remesh_jobs.values():
+                future.result()
+            self.upload_meshes(float("inf"))
+
+    def update_voxels(self, box_min, box_max):
+        # Remesh every section whose faces can change with the voxels in the inclusive box: the sections
+        # under the box, widened to whole cells of the coarsest LOD and grown by one voxel along each axis
+        # in turn, which reaches into neighbouring chunks
+        cell = LOD_SCALES[-1]
+        for axis in range(3):
+            low = [c // cell * cell for c in box_min]
+            high = [c // cell * cell + cell - 1 for c in box_max]
+            low[axis] -= 1
+            high[axis] += 1
+            for cx in range(low[0] // CHUNK_SIZE, high[0] // CHUNK_SIZE + 1):
+                for cy in range(low[1] // CHUNK_SIZE, high[1] // CHUNK_SIZE + 1):
+                    for cz in range(low[2] // CHUNK_SIZE, high[2] // CHUNK_SIZE + 1):
+                        chunk_index = get_chunk_index((cx * CHUNK_SIZE, cy * CHUNK_SIZE, cz * CHUNK_SIZE), self.chunk_grid)
+                        if chunk_index == -1:
+                            continue
+                        y_start = max(low[1] - cy * CHUNK_SIZE, 0)
+                        y_end = min(high[1] - cy * CHUNK_SIZE, CHUNK_SIZE - 1)
+                        self.update_chunk(chunk_index, range(y_start // SECTION_HEIGHT, y_end // SECTION_HEIGHT + 1))
 
     def update_voxel_selection(self):
-        self.world_voxel_pos_selection, self.normal_selection = cast_ray(origin=glm.vec3(self.app.camera.position), 
-                                                                         direction=glm.vec3(glm.cross(self.app.camera.up, self.app.camera.right)), 
-                                                                         world_voxels=self.voxels)
+        camera = self.app.camera
+        selection_key = (bytes(camera.position), bytes(camera.up), bytes(camera.right), self.edit_generation)
+        if selection_key == self.selection_key:
+            return
+        self.selection_key = selection_key
+        self.world_voxel_pos_selection, self.normal_selection = cast_ray(origin=camera.position, 
+                                                                         direction=glm.cross(camera.up, camera.right), 
+                                                                         world_voxels=self.voxels,
+                                                                         chunk_grid=self.chunk_grid,
+                                                                         solid_counts=self.solid_counts,
+                                                                         brick_counts=self.brick_counts)
 
     def set_voxel(self):
         if self.world_voxel_pos_selection:
@@ -275,51 +1521,426 @@ class World:
                 self.remove_voxel(self.world_voxel_pos_selection)
     
     def add_voxel(self, world_voxel_pos):
-        chunk_index = get_chunk_index(world_voxel_pos)
+        chunk_index = get_chunk_index(world_voxel_pos, self.chunk_grid)
+        # Placing against the top or bottom of the world, or at the edge of the loaded columns, lands outside it
+        if chunk_index == -1:
+            return
         voxel_index = world_voxel_pos.x % CHUNK_SIZE + (world_voxel_pos.y % CHUNK_SIZE) * CHUNK_SIZE + (world_voxel_pos.z % CHUNK_SIZE) * CHUNK_AREA
         new_voxel_id = self.app.voxel_id_selection
+        if not self.voxels[chunk_index][voxel_index]:
+            self.solid_counts[chunk_index] += 1
+            self.brick_counts[chunk_index, get_brick_index(voxel_index)] += 1
         self.voxels[chunk_index][voxel_index] = new_voxel_id
         self.chunks[chunk_index].voxels[voxel_index] = new_voxel_id
-        self.update_chunk(chunk_index)
+        self.edit_generation += 1
+        self.mark_edited(chunk_index)
+        self.update_voxels(world_voxel_pos, world_voxel_pos)
+        self.relight(tuple(world_voxel_pos))
 
     def remove_voxel(self, world_voxel_pos):
-        chunk_index = get_chunk_index(world_voxel_pos)
-        wx, wy, wz = world_voxel_pos
-        cx, cy, cz = world_voxel_pos % CHUNK_SIZE
+        chunk_index = get_chunk_index(world_voxel_pos, self.chunk_grid)
+        if chunk_index == -1:
+            return
+        cx, cy, cz = (c % CHUNK_SIZE for c in world_voxel_pos)
         voxel_index = cx + cy * CHUNK_SIZE + cz * CHUNK_AREA
+        if self.voxels[chunk_index][voxel_index]:
+            self.solid_counts[chunk_index] -= 1
+            self.brick_counts[chunk_index, get_brick_index(voxel_index)] -= 1
         self.voxels[chunk_index][voxel_index] = 0
         self.chunks[chunk_index].voxels[voxel_index] = 0
-        self.update_chunk(chunk_index)
-        if cx == 0:
-            self.update_chunk(get_chunk_index((wx - 1, wy, wz)))
-        elif cx == CHUNK_SIZE - 1:
-            self.update_chunk(get_chunk_index((wx + 1, wy, wz)))
-        if cy == 0:
-            self.update_chunk(get_chunk_index((wx, wy - 1, wz)))
-        elif cy == CHUNK_SIZE - 1:
-            self.update_chunk(get_chunk_index((wx, wy + 1, wz)))
-        if cz == 0:
-            self.update_chunk(get_chunk_index((wx, wy, wz - 1)))
-        elif cz == CHUNK_SIZE - 1:
-            self.update_chunk(get_chunk_index((wx, wy, wz + 1)))
+        self.edit_generation += 1
+        self.mark_edited(chunk_index)
+        self.update_voxels(world_voxel_pos, world_voxel_pos)
+        self.relight(tuple(world_voxel_pos))
 
-    def render(self):
+    def fill_mask(self, origin, mask, voxel_id, replace=None):
+        # Sets every voxel under the [x, y, z] boolean mask placed at the world voxel origin to voxel_id, or only
+        # those currently equal to replace; each touched chunk is remeshed once, returns the voxels changed
+        origin = np.array(tuple(origin), dtype=np.int64)
+        first = origin // CHUNK_SIZE
+        last = (origin + mask.shape - 1) // CHUNK_SIZE
+        changed_positions = []
+        for cx in range(first[0], last[0] + 1):
+            for cy in range(first[1], last[1] + 1):
+                for cz in range(first[2], last[2] + 1):
+                    chunk_origin = np.array((cx, cy, cz)) * CHUNK_SIZE
+                    chunk_index = get_chunk_index((cx * CHUNK_SIZE, cy * CHUNK_SIZE, cz * CHUNK_SIZE), self.chunk_grid)
+                    if chunk_index == -1:
+                        continue
+                    # The overlap of the mask and the chunk, in chunk coordinates
+                    low = np.maximum(origin, chunk_origin) - chunk_origin
+                    high = np.minimum(origin + mask.shape, chunk_origin + CHUNK_SIZE) - chunk_origin
+                    offset = chunk_origin - origin
+                    region = mask[low[0] + offset[0]:high[0] + offset[0],
+                                  low[1] + offset[1]:high[1] + offset[1],
+                                  low[2] + offset[2]:high[2] + offset[2]]
+                    # Chunk voxels are indexed x + y * CHUNK_SIZE + z * CHUNK_AREA, so the transposed view is [x, y, z]
+                    chunk_voxels = self.voxels[chunk_index]
+                    voxels = chunk_voxels.reshape(CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE).T[low[0]:high[0], low[1]:high[1], low[2]:high[2]]
+                    changed = region & (voxels != voxel_id)
+                    if replace is not None:
+                        changed &= voxels == replace
+                    changed_voxels = np.argwhere(changed)
+                    if not len(changed_voxels):
+                        continue
+                    voxels[changed] = voxel_id
+                    changed_positions.append(chunk_origin + low + changed_voxels)
+                    self.solid_counts[chunk_index] = np.count_nonzero(chunk_voxels)
+                    self.brick_counts[chunk_index] = count_brick_voxels(chunk_voxels)
+                    self.mark_edited(chunk_index)
+                    box_min = chunk_origin + low + changed_voxels.min(axis=0)
+                    box_max = chunk_origin + low + changed_voxels.max(axis=0)
+                    self.update_voxels(box_min.tolist(), box_max.tolist())
+        if changed_positions:
+            self.edit_generation += 1
+            self.relight(np.concatenate(changed_positions))
+        return sum(len(positions) for positions in changed_positions)
+
+    def fill_box(self, box_min, box_max, voxel_id, replace=None):
+        # Inclusive world voxel corners
+        box_min = np.array(tuple(box_min), dtype=np.int64)
+        box_max = np.array(tuple(box_max), dtype=np.int64)
+        return self.fill_mask(box_min, np.ones(box_max - box_min + 1, dtype=bool), voxel_id, replace)
+
+    def fill_sphere(self, centre, radius, voxel_id, replace=None):
+        # Every voxel whose position lies within radius of the centre voxel
+        extent = int(radius)
+        offsets = np.arange(-extent, extent + 1)
+        mask = offsets[:, None, None] ** 2 + offsets[None, :, None] ** 2 + offsets[None, None, :] ** 2 <= radius ** 2
+        return self.fill_mask(np.array(tuple(centre), dtype=np.int64) - extent, mask, voxel_id, replace)
+
+    def build_vao(self):
+        # The arena moved its blocks into a new buffer, so point the VAO at it and refresh the offsets
+        if self.vao:
+            self.vao.release()
+        buffers = [(self.arena.buffer, self.vbo_format, *self.attrs)]
+        if self.indirect_draws:
+            buffers.append((self.chunk_origins, "3i/i", "chunk_origin"))
+        elif self.quad_ibo.size < self.arena.capacity // 4 * 24:
+            # Plain draws take no base vertex, so the indices must reach every quad in the arena
+            self.quad_ibo.release()
+            self.quad_ibo = self.app.ctx.buffer(quad_indices(self.arena.capacity // 4))
+        self.vao = self.app.ctx.vertex_array(
+            self.app.program,
+            buffers,
+            index_buffer=self.quad_ibo,
+            index_element_size=4,
+            skip_errors=True
+        )
         for chunk in self.chunks:
-            chunk.render()
+            if chunk:
+                for lod, blocks in enumerate(chunk.mesh.blocks):
+                    for section, block in enumerate(blocks):
+                        if block:
+                            self.draw_first[lod, chunk.index * CHUNK_SECTIONS + section] = block.offset
+        self.vao_version = self.arena.version
+
+    def draw_commands(self, section_lods, section_indices):
+        # Indexed indirect draw commands (count, instances, first index, base vertex, base instance),
+        # with the chunk's index as base instance to fetch its origin
+        commands = np.zeros((len(section_indices), 5), dtype=np.uint32)
+        commands[:, 0] = self.draw_count[section_lods, section_indices] // 4 * 6
+        commands[:, 1] = 1
+        commands[:, 3] = self.draw_first[section_lods, section_indices]
+        commands[:, 4] = section_indices // CHUNK_SECTIONS
+        return commands
+
+    def draw_sections(self, section_lods, section_indices):
+        # Without indirect draws, each section is its own call with its chunk's origin set as a uniform
+        chunk_origin = self.app.program["chunk_origin"]
+        firsts = self.draw_first[section_lods, section_indices] // 4 * 6
+        counts = self.draw_count[section_lods, section_indices] // 4 * 6
+        origins = self.chunk_min[section_indices // CHUNK_SECTIONS].astype(np.int32)
+        for first, count, origin in zip(firsts.tolist(), counts.tolist(), origins.tolist()):
+            chunk_origin.value = tuple(origin)
+            self.vao.render(vertices=count, first=first)
+
+    def render(self):
+        if self.vao_version != self.arena.version:
+            self.build_vao()
+        camera = self.app.camera
+        # Each chunk is drawn at the LOD for the distance from the camera to its centre
+        distances = np.linalg.norm(self.chunk_min + CHUNK_SIZE / 2 - np.array(camera.position), axis=1)
+        section_lods = np.repeat(np.searchsorted(LOD_DISTANCES, distances), CHUNK_SECTIONS)
+        section_indices = np.flatnonzero(self.draw_count[section_lods, np.arange(len(section_lods))])
+        section_count = len(section_indices)
+        if self.frustum_culling:
+            planes = frustum_planes(camera.projection.matrix, camera.matrix)
+            box_min = self.chunk_min[section_indices // CHUNK_SECTIONS]
+            box_min[:, 1] += section_indices % CHUNK_SECTIONS * SECTION_HEIGHT
+            box_size = np.array([CHUNK_SIZE, SECTION_HEIGHT, CHUNK_SIZE])
+            section_indices = section_indices[boxes_in_frustum(planes, box_min, box_min + box_size)]
+        self.sections_drawn = len(section_indices)
+        self.sections_culled = section_count - self.sections_drawn
+        if len(section_indices) and self.indirect_draws:
+            self.indirect.write(self.draw_commands(section_lods[section_indices], section_indices))
+            self.vao.render_indirect(self.indirect, count=len(section_indices))
+        elif len(section_indices):
+            self.draw_sections(section_lods[section_indices], section_indices)
+
+class StreamingWorld(World):
+    # Columns of chunks within the stream radius of the camera are generated and meshed in the background
+    # and evicted once they fall behind it. Each column has a fixed slot in a ring wrapping around the world,
+    # so memory stays the same however far the camera travels
+    def __init__(self, app, radius=STREAM_RADIUS, workers=MESH_WORKERS, store=None, profiler=None):
+        self.radius = radius
+        # Meshing a column needs its neighbours, so they are generated one column further out,
+        # and kept one further again so that turning back does not regenerate them
+        ring_size = 2 * (radius + 2) + 1
+        self.chunk_store = {}
+        self.column_epochs = {}
+        self.meshed_columns = set()
+        self.edited_columns = set()
+        self.column_archive = {}
+        self.generate_jobs = {}
+        self.mesh_jobs = {}
+        self.generate_queue = []
+        self.mesh_queue = []
+        # Loaded columns whose light has not crossed to and from their neighbours yet
+        self.unlit_columns = set()
+        self.centre = None
+        self.epoch = 0
+        self.max_jobs = 2 * workers
+        super().__init__(app, size=(ring_size, WORLD_H, ring_size), store=store, workers=workers, profiler=profiler)
+
+    def build_chunks(self):
+        self.chunk_min[:] = np.nan
+
+    def build_chunk_meshes(self):
+        pass
+
+    def chunk_slot(self, x, y, z):
+        width, height, depth = self.size
+        return x % width + y * width + z % depth * width * height
+
+    def column_distance(self, column):
+        return max(abs(column[0] - self.centre[0]), abs(column[1] - self.centre[1]))
+
+    def column_priority(self, column):
+        return (column[0] - self.centre[0]) ** 2 + (column[1] - self.centre[1]) ** 2
+
+    @staticmethod
+    def neighbour_columns(column):
+        cx, cz = column
+        return column, (cx + 1, cz), (cx - 1, cz), (cx, cz + 1), (cx, cz - 1)
+
+    def neighbour_epochs(self, column):
+        # A mesh is only kept if neither its column nor the neighbours it was padded from changed meanwhile
+        return tuple(self.column_epochs.get(key) for key in self.neighbour_columns(column))
+
+    def update_chunk(self, chunk_index, sections=range(CHUNK_SECTIONS)):
+        # Columns not meshed yet are meshed whole once their neighbours are in, so only their epoch changes
+        if chunk_index != -1:
+            x, _, z = self.chunks[chunk_index].position
+            self.epoch += 1
+            self.column_epochs[(x, z)] = self.epoch
+            if (x, z) in self.meshed_columns:
+                super().update_chunk(chunk_index, sections)
+
+    def mark_edited(self, chunk_index):
+        super().mark_edited(chunk_index)
+        x, _, z = self.chunks[chunk_index].position
+        self.edited_columns.add((x, z))
+
+    def stream(self, uploads=STREAM_UPLOADS_PER_FRAME):
+        position = self.app.camera.position
+        centre = (int(position.x // CHUNK_SIZE), int(position.z // CHUNK_SIZE))
+        if centre != self.centre:
+            self.centre = centre
+            self.queue_columns()
+        # Light jobs read and write every loaded slot, so columns only come and go between them; the columns
+        # loaded meanwhile are lit by the job started right after
+        if self.collect_light():
+            self.unlit_columns.clear()
+            for column in [column for column in self.column_epochs if self.column_distance(column) > self.radius + 2]:
+                self.unload_column(column)
+            uploads = self.load_columns(uploads)
+            self.update_light()
+        self.finish_jobs(uploads)
+        self.submit_jobs()
+
+    def queue_columns(self):
+        cx, cz = self.centre
+        reach = self.radius + 1
+        columns = [(cx + dx, cz + dz) for dx in range(-reach, reach + 1) for dz in range(-reach, reach + 1)]
+        columns.sort(key=self.column_priority)
+        self.generate_queue = [column for column in columns if column not in self.column_epochs and column not in self.generate_jobs]
+        self.mesh_queue = [column for column in columns if self.column_distance(column) <= self.radius
+                           and column not in self.meshed_columns and column not in self.mesh_jobs]
+
+    def submit_jobs(self):
+        jobs = len(self.generate_jobs) + len(self.mesh_jobs)
+        for column in list(self.mesh_queue):
+            if jobs >= self.max_jobs:
+                return
+            epochs = self.neighbour_epochs(column)
+            if None in epochs or self.unlit_columns.intersection(self.neighbour_columns(column)):
+                continue
+            self.mesh_queue.remove(column)
+            chunks = [self.chunk_store[(column[0], y, column[1])] for y in range(WORLD_H)]
+            self.mesh_jobs[column] = (self.pool.submit(self.profiler.timed("mesh", self.mesh_chunks), chunks), epochs)
+            jobs += 1
+        while self.generate_queue and jobs < self.max_jobs:
+            column = self.generate_queue.pop(0)
+            job = self.profiler.timed("generate", self.read_column)
+            self.generate_jobs[column] = self.pool.submit(job, column, self.column_archive.get(column))
+            jobs += 1
+
+    def read_column(self, column, archived):
+        # A column comes from the archive, else from the region files, generating whatever was never saved,
+        # and is lit here on its own; also returns its light and which of its chunks were generated
+        cx, cz = column
+        if archived:
+            chunks = archived
+        else:
+            chunks = [self.store.load((cx, y, cz)) if self.store else None for y in range(WORLD_H)]
+        if None in chunks:
+            voxels = generate_terrain(cx, cz, 1, 1)
+        else:
+            voxels = np.empty((1, WORLD_H, 1, CHUNK_VOL), dtype=np.uint8)
+        for y, chunk in enumerate(chunks):
+            if chunk:
+                chunk.to_dense(voxels[0, y, 0])
+        column_voxels = voxels.reshape(WORLD_H, CHUNK_VOL)
+        light = sky_light(column_voxels[None])[0]
+        origins = np.array([(cx, y, cz) for y in range(WORLD_H)], dtype=np.int64) * CHUNK_SIZE
+        chunk_grid = origins.astype(np.float64).reshape(1, WORLD_H, 1, 3)
+        queue, count = seed_light(column_voxels, light, chunk_grid, np.arange(WORLD_H), origins)
+        spread_light(column_voxels, light, chunk_grid, queue, count, np.zeros((WORLD_H, CHUNK_SECTIONS), dtype=np.bool_))
+        return voxels, light, [chunk is None for chunk in chunks]
+
+    @staticmethod
+    def mesh_chunks(chunks):
+        for chunk in chunks:
+            chunk.mesh.build_mesh()
+        return chunks
+
+    def load_columns(self, uploads):
+        # At most `uploads` finished columns are taken per frame, so crossing into new chunks never stalls a frame;
+        # returns how many more can be
+        for column, future in list(self.generate_jobs.items()):
+            if uploads <= 0:
+                break
+            if future.done():
+                del self.generate_jobs[column]
+                if self.column_distance(column) <= self.radius + 2:
+                    self.load_column(column, future.result())
+                    uploads -= 1
+        return uploads
+
+    def finish_jobs(self, uploads):
+        for column, (future, epochs) in list(self.mesh_jobs.items()):
+            if uploads <= 0:
+                return
+            if future.done():
+                del self.mesh_jobs[column]
+                if epochs != self.neighbour_epochs(column):
+                    # Stale, possibly read from slots that were reused; mesh it again if it is still wanted
+                    if column in self.column_epochs and self.column_distance(column) <= self.radius:
+                        self.mesh_queue.insert(0, column)
+                    continue
+                with self.profiler.scope("upload"):
+                    for chunk in future.result():
+                        chunk.mesh.build_vao()
+                self.meshed_columns.add(column)
+                uploads -= 1
+
+    def load_column(self, column, result):
+        voxels, light, generated = result
+        cx, cz = column
+        self.epoch += 1
+        self.edit_generation += 1
+        self.column_epochs[column] = self.epoch
+        if self.column_archive.pop(column, None):
+            self.edited_columns.add(column)
+        for y in range(WORLD_H):
+            chunk_index = self.chunk_slot(cx, y, cz)
+            chunk = Chunk(world=self, position=(cx, y, cz), index=chunk_index)
+            self.voxels[chunk_index] = voxels[0, y, 0]
+            self.light[chunk_index] = light[y]
+            chunk.voxels = self.voxels[chunk_index]
+            self.chunks[chunk_index] = chunk
+            self.chunk_store[chunk.position] = chunk
+            self.solid_counts[chunk_index] = np.count_nonzero(chunk.voxels)
+            self.brick_counts[chunk_index] = count_brick_voxels(chunk.voxels)
+            self.chunk_min[chunk_index] = np.array(chunk.position) * CHUNK_SIZE
+            self.chunk_origins.write(self.chunk_min[chunk_index].astype(np.int32), offset=chunk_index * 12)
+            if generated[y]:
+                self.dirty_chunks.add(chunk.position)
+        # Its light spreads to and from the loaded columns around it in the next light job
+        self.light_chunks.append(np.array([self.chunk_slot(cx, y, cz) for y in range(WORLD_H)]))
+        self.unlit_columns.add(column)
+
+    def saved_chunk(self, position):
+        x, y, z = position
+        if (x, z) in self.column_archive:
+            return self.column_archive[(x, z)][y]
+        return super().saved_chunk(position)
+
+    def save(self):
+        # Once on disk, archived columns are read back from their region instead
+        super().save()
+        if self.store:
+            self.column_archive.clear()
+
+    def unload_column(self, column):
+        # Unedited columns can be generated again, edited ones are kept compressed until they come back
+        cx, cz = column
+        self.edit_generation += 1
+        del self.column_epochs[column]
+        self.meshed_columns.discard(column)
+        if column in self.edited_columns:
+            self.edited_columns.discard(column)
+            self.column_archive[column] = [PaletteChunk.from_dense(self.chunk_store[(cx, y, cz)].voxels) for y in range(WORLD_H)]
+        else:
+            self.dirty_chunks.difference_update((cx, y, cz) for y in range(WORLD_H))
+        for y in range(WORLD_H):
+            chunk = self.chunk_store.pop((cx, y, cz))
+            chunk.mesh.clear()
+            self.dirty_sections.pop(chunk.index, None)
+            self.chunks[chunk.index] = None
+            self.chunk_min[chunk.index] = np.nan
+
+    def render(self):
+        with self.profiler.scope("stream"):
+            self.stream()
+        super().render()
+
+############ WARM-UP ############
+
+def warm_up_kernels():
+    # Building the world and drawing the first frame compile, or load from numba's on-disk cache, every kernel
+    # but those only edits reach. This calls them once on a one-chunk world, with the argument types the engine
+    # passes, so the first edit does not stall on them. It runs on a thread once the first frame is up, as numba
+    # compiles one kernel at a time and anything started earlier would only hold up the world
+    voxels = np.zeros((1, CHUNK_VOL), dtype=np.uint8)
+    voxels[0, :CHUNK_AREA] = 6
+    voxels[0, CHUNK_AREA] = 2
+    light = np.zeros((1, CHUNK_VOL), dtype=np.uint8)
+    chunk_grid = np.zeros((1, 1, 1, 3))
+    touched = np.zeros((1, CHUNK_SECTIONS), dtype=np.bool_)
+    get_chunk_index(glm.ivec3(0), chunk_grid)
+    relight_voxels(voxels, light, chunk_grid, np.array([[0, 0, 0], [0, 1, 0]], dtype=np.int64), touched)
 
 ############ RENDER ###########
 
 class VoxelEngine(CameraWindow):
     title = "Voxel Engine - Tanmay Bansal"
+    gl_version = (3, 3)
     resource_dir = (Path(__file__).parent / "resources").resolve()
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.wnd.mouse_exclusivity = True
         #self.program = self.load_program(path="chunk_simple.glsl")
-        self.program = self.load_program(path="chunk_texture_mapped.glsl")
+        self.program = self.load_program(path="chunk_packed.glsl" if PACKED_VERTICES else "chunk_texture_mapped.glsl",
+                                         defines={"INDIRECT_DRAWS": int(self.ctx.version_code >= INDIRECT_DRAW_VERSION)})
         self.selection_program = self.load_program(path="voxel_selection.glsl")
-        self.world = World(self)
+        store = RegionStore(SAVE_DIR)
+        self.profiler = Profiler(self.ctx)
+        world_type = StreamingWorld if STREAMING_WORLD else World
+        self.world = world_type(self, store=store, profiler=self.profiler)
+        self.warm_up = threading.Thread(target=warm_up_kernels, daemon=True)
         self.ctx.front_face = "ccw"
         self.interaction_mode = 1
         self.voxel_id_selection = 1
@@ -346,7 +1967,17 @@ class VoxelEngine(CameraWindow):
         self.texture_array = self.load_texture_array("tex_array_0.png", layers=7, flip=True)
         self.texture_array.use(location=0)
 
+        self.show_profiler = False
+        self.overlay = None
+        if imgui:
+            imgui.create_context()
+            self.overlay = ModernglWindowRenderer(self.wnd)
+
     def key_event(self, key, action, modifiers):
+        with self.profiler.scope("input"):
+            self.handle_key(key, action, modifiers)
+
+    def handle_key(self, key, action, modifiers):
         keys = self.wnd.keys
         self.camera.key_input(key, action, modifiers)
         if action == keys.ACTION_PRESS:
@@ -356,19 +1987,43 @@ class VoxelEngine(CameraWindow):
                 self.voxel_id_selection = (self.voxel_id_selection) % 7 + 1
             elif key == keys.M:
                 self.world.set_voxel()
+            elif key == keys.F5:
+                self.world.save()
+            elif key == keys.I:
+                print(self.world.arena.stats())
+                print(f"sections drawn: {self.world.sections_drawn}, culled: {self.world.sections_culled}")
+            elif key == keys.F3:
+                self.show_profiler = not self.show_profiler
+            elif key == keys.P:
+                self.profiler.save_json(SAVE_DIR / "profile.json")
+                self.profiler.save_trace(SAVE_DIR / "profile_trace.json")
+                for name, stats in self.profiler.stats().items():
+                    print(f"{name}: p50 {stats['p50']:.2f} ms, p95 {stats['p95']:.2f} ms, p99 {stats['p99']:.2f} ms")
+
+    def resize(self, width: int, height: int):
+        super().resize(width, height)
+        if self.overlay:
+            self.overlay.resize(width, height)
+
+    def close(self):
+        self.world.save()
 
     def mouse_press_event(self, x, y, button):
         mouse_buttons = self.wnd.mouse
         if button == mouse_buttons.left:
-            self.world.set_voxel()
+            with self.profiler.scope("input"):
+                self.world.set_voxel()
 
     def render(self, time, frame_time):
         self.ctx.enable_only(moderngl.DEPTH_TEST | moderngl.CULL_FACE)
         self.program["m_proj"].write(self.camera.projection.matrix)
         self.program["m_camera"].write(self.camera.matrix)
-        self.world.render()
+        self.world.upload_meshes(MESH_UPLOAD_BUDGET_MS)
+        with self.profiler.scope("draw", gpu=True):
+            self.world.render()
 
-        self.world.update_voxel_selection()
+        with self.profiler.scope("raycast"):
+            self.world.update_voxel_selection()
         if self.world.world_voxel_pos_selection:
             if self.interaction_mode:
                 selection_model_matrix = glm.translate(glm.mat4(1.0), glm.vec3(self.world.world_voxel_pos_selection + (self.world.normal_selection) * 1.1))
@@ -380,5 +2035,21 @@ class VoxelEngine(CameraWindow):
             self.selection_program["m_model"].write(selection_model_matrix)
             self.selection_vao.render(moderngl.LINES)
 
+        if self.show_profiler and self.overlay:
+            self.draw_profiler()
+        self.profiler.end_frame()
+        if self.warm_up.ident is None:
+            self.warm_up.start()
+
+    def draw_profiler(self):
+        imgui.new_frame()
+        imgui.begin("Debug Panel")
+        imgui.text(f"{'scope':<12}{'p50':>8}{'p95':>8}{'p99':>8}")
+        for name, stats in self.profiler.stats().items():
+            imgui.text(f"{name:<12}{stats['p50']:8.2f}{stats['p95']:8.2f}{stats['p99']:8.2f}")
+        imgui.end()
+        imgui.render()
+        self.overlay.render(imgui.get_draw_data())
+
 if __name__ == "__main__":
     mglw.run_window_config(VoxelEngine)
\ No newline at end of file
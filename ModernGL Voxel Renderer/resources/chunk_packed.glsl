@@ -0,0 +1,70 @@
+#version 330 core
+
+// Set to 1 where the world is drawn with indirect calls, which pick each chunk's origin by base instance;
+// otherwise sections are drawn one at a time with the origin as a uniform
+#define INDIRECT_DRAWS 0
+
+#if defined VERTEX_SHADER
+
+// Vertex shader
+layout(location = 0) in uint packed_data;
+#if INDIRECT_DRAWS
+layout(location = 1) in ivec3 chunk_origin;
+#else
+uniform ivec3 chunk_origin;
+#endif
+
+uniform mat4 m_proj;
+uniform mat4 m_camera;
+
+out vec2 uv;
+flat out vec2 tile_layer;
+out float shade;
+
+
+void main() {
+    // x, y, z in 6 bits each, voxel_id and face_id in 3 bits each, then sunlight and block light in 4 bits each
+    vec3 in_position = vec3(packed_data & 63u, (packed_data >> 6u) & 63u, (packed_data >> 12u) & 63u);
+    uint voxel_id = (packed_data >> 18u) & 7u;
+    uint face_id = (packed_data >> 21u) & 7u;
+    uint light = packed_data >> 24u;
+
+    gl_Position = m_proj * m_camera * vec4(in_position + vec3(chunk_origin), 1.0);
+
+    // Shading and texture coordinates based on face_id; coordinates follow the face plane so quads tile per voxel
+    switch (int(face_id)) {
+        case 0: shade = 1.0; uv = vec2(in_position.x, -in_position.z); break; // top face, fully lit
+        case 1: shade = 0.3; uv = vec2(in_position.x, in_position.z); break; // bottom face, darker
+        case 2: shade = 0.7; uv = vec2(-in_position.z, in_position.y); break; // left face, medium light
+        case 3: shade = 0.7; uv = vec2(in_position.z, in_position.y); break; // right face, medium light
+        case 4: shade = 0.9; uv = vec2(in_position.x, in_position.y); break; // front face, slightly dim
+        case 5: shade = 0.5; uv = vec2(-in_position.x, in_position.y); break; // back face, dim
+        default: shade = 1.0; uv = vec2(0.0); break;
+    }
+
+    // Sunlight and block light from 0 to 15, each step darker dimming by a fifth
+    float level = float(max(light >> 4u, light & 15u));
+    shade *= max(pow(0.8, 15.0 - level), 0.05);
+
+    tile_layer = vec2(min(face_id, 2u), int(voxel_id) - 1);
+
+}
+
+#elif defined FRAGMENT_SHADER
+
+// Fragment shader
+in vec2 uv;
+flat in vec2 tile_layer;
+in float shade;
+
+uniform sampler2DArray u_texture_array_0;
+
+out vec4 frag_color;
+
+void main() {
+    vec2 tile_uv = fract(uv);
+    vec3 frag_tex_array_coord = vec3((tile_uv.x + tile_layer.x) / 3.0, tile_uv.y, tile_layer.y);
+    frag_color = texture(u_texture_array_0, frag_tex_array_coord) * shade;
+}
+
+#endif
@@ -1,15 +1,23 @@
 #version 330 core
 
+// Set to 1 where the world is drawn with indirect calls, which pick each chunk's origin by base instance;
+// otherwise sections are drawn one at a time with the origin as a uniform
+#define INDIRECT_DRAWS 0
+
 #if defined VERTEX_SHADER
 
 // Vertex shader
 layout(location = 0) in vec3 in_position;
 layout(location = 1) in uint voxel_id;
 layout(location = 2) in uint face_id;
+#if INDIRECT_DRAWS
+layout(location = 3) in ivec3 chunk_origin;
+#else
+uniform ivec3 chunk_origin;
+#endif
 
 uniform mat4 m_proj;
 uniform mat4 m_camera;
-uniform mat4 m_model;
 
 out vec3 color;
 out float shade;
@@ -22,10 +30,10 @@ vec3 hash31(float p) {
 
 void main() {
     color = hash31(voxel_id);
-    gl_Position = m_proj * m_camera * m_model * vec4(in_position, 1.0);
+    gl_Position = m_proj * m_camera * vec4(in_position + vec3(chunk_origin), 1.0);
 
     // Shading based on face_id
-    switch (face_id) {
+    switch (int(face_id)) {
         case 0: shade = 1.0; break; // top face, fully lit
         case 1: shade = 0.5; break; // bottom face, darker
         case 2: shade = 0.8; break; // left face, medium light
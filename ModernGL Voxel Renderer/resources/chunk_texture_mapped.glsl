@@ -1,5 +1,9 @@
 #version 330 core
 
+// Set to 1 where the world is drawn with indirect calls, which pick each chunk's origin by base instance;
+// otherwise sections are drawn one at a time with the origin as a uniform
+#define INDIRECT_DRAWS 0
+
 #if defined VERTEX_SHADER
 
 // Vertex shader
@@ -7,20 +11,26 @@ layout(location = 0) in vec3 in_position;
 layout(location = 1) in uint voxel_id;
 layout(location = 2) in uint face_id;
 layout(location = 3) in vec2 in_texcoord;
+#if INDIRECT_DRAWS
+layout(location = 4) in ivec3 chunk_origin;
+#else
+uniform ivec3 chunk_origin;
+#endif
+layout(location = 5) in uint in_light;
 
 uniform mat4 m_proj;
 uniform mat4 m_camera;
-uniform mat4 m_model;
 
-out vec3 frag_tex_array_coord;
+out vec2 uv;
+flat out vec2 tile_layer;
 out float shade;
 
 
 void main() {
-    gl_Position = m_proj * m_camera * m_model * vec4(in_position, 1.0);
+    gl_Position = m_proj * m_camera * vec4(in_position + vec3(chunk_origin), 1.0);
 
     // Shading based on face_id
-    switch (face_id) {
+    switch (int(face_id)) {
         case 0: shade = 1.0; break; // top face, fully lit
         case 1: shade = 0.3; break; // bottom face, darker
         case 2: shade = 0.7; break; // left face, medium light
@@ -30,14 +40,21 @@ void main() {
         default: shade = 1.0; break;
     }
 
-    frag_tex_array_coord = vec3((in_texcoord.x + min(face_id, 2)) / 3.0, in_texcoord.y, int(voxel_id) - 1);
+    // Sunlight and block light from 0 to 15, each step darker dimming by a fifth
+    float level = float(max(in_light >> 4u, in_light & 15u));
+    shade *= max(pow(0.8, 15.0 - level), 0.05);
+
+    // Greedy quads carry texture coordinates larger than 1, tiled per voxel in the fragment shader
+    uv = in_texcoord;
+    tile_layer = vec2(min(face_id, 2u), int(voxel_id) - 1);
 
 }
 
 #elif defined FRAGMENT_SHADER
 
 // Fragment shader
-in vec3 frag_tex_array_coord;
+in vec2 uv;
+flat in vec2 tile_layer;
 in float shade;
 
 uniform sampler2DArray u_texture_array_0;
@@ -46,6 +63,8 @@ out vec4 frag_color;
 
 void main() {
     //frag_color = vec4(v_texcoord, 0.0, 1.0);  // Apply the shade factor to color
+    vec2 tile_uv = fract(uv);
+    vec3 frag_tex_array_coord = vec3((tile_uv.x + tile_layer.x) / 3.0, tile_uv.y, tile_layer.y);
     frag_color = texture(u_texture_array_0, frag_tex_array_coord) * shade;
 }
 
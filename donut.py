@@ -20,7 +20,7 @@ def clear_screen():
     else:
         _ = os.system('clear')
 
-@njit
+@njit(cache=True)
 def render_frame(A, B):
     cos_A, sin_A = np.cos(A), np.sin(A)
     cos_B, sin_B = np.cos(B), np.sin(B)